@@ -1,18 +1,159 @@
+import time
+# Start of ``import app``, for the startup report
+IMPORT_STARTED = time.perf_counter()
+
 from flask import Flask
 from flask_login import LoginManager
+from werkzeug.middleware.proxy_fix import ProxyFix
 import os
-import resend
 
 # Initialize Flask app
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'supersecretkey')
 
-# Initialize Resend API Key
-resend.api_key = os.environ.get('RESEND_API_KEY')
+# Datastore backend used by app.models: firestore, memory or sqlite
+app.config['STORAGE_BACKEND'] = os.environ.get('STORAGE_BACKEND', 'firestore')
+app.config['FIRESTORE_DATABASE'] = os.environ.get('FIRESTORE_DATABASE', 'giftster-db')
+app.config['SQLITE_PATH'] = os.environ.get('SQLITE_PATH', os.path.join(app.instance_path, 'giftster.db'))
+app.config['STORAGE_LATENCY_MS'] = float(os.environ.get('STORAGE_LATENCY_MS', 0))
+
+# Datastore RPC tracing: a Server-Timing header and a JSON log line per
+# request, with the full RPC trace for requests slower than SLOW_REQUEST_MS
+app.config['DATASTORE_INSTRUMENTATION'] = os.environ.get('DATASTORE_INSTRUMENTATION', '1') == '1'
+app.config['DATASTORE_LOG'] = os.environ.get('DATASTORE_LOG', '1') == '1'
+app.config['SLOW_REQUEST_MS'] = float(os.environ.get('SLOW_REQUEST_MS', 1000))
+
+# Process-wide cache of users loaded by the Flask-Login user_loader. Entries
+# live for USER_CACHE_TTL seconds, so a password change made through another
+# worker is picked up within that window.
+app.config['USER_CACHE_SIZE'] = int(os.environ.get('USER_CACHE_SIZE', 1024))
+app.config['USER_CACHE_TTL'] = float(os.environ.get('USER_CACHE_TTL', 60))
+
+# Members shown per page of group_detail
+app.config['GROUP_PAGE_SIZE'] = int(os.environ.get('GROUP_PAGE_SIZE', 50))
+
+# Claimed gifts shown per page of My Claims
+app.config['CLAIMS_PAGE_SIZE'] = int(os.environ.get('CLAIMS_PAGE_SIZE', 50))
+
+# Live gift updates over Server-Sent Events. Every open stream holds a
+# worker thread, so LIVE_MAX_CONNECTIONS per worker must stay below the
+# gunicorn thread count. Streams end after LIVE_STREAM_SECONDS and browsers
+# reconnect; listeners with no streams stop after LIVE_IDLE_SECONDS.
+app.config['LIVE_MAX_CONNECTIONS'] = int(os.environ.get('LIVE_MAX_CONNECTIONS', 4))
+app.config['LIVE_IDLE_SECONDS'] = float(os.environ.get('LIVE_IDLE_SECONDS', 30))
+app.config['LIVE_HEARTBEAT_SECONDS'] = float(os.environ.get('LIVE_HEARTBEAT_SECONDS', 15))
+app.config['LIVE_STREAM_SECONDS'] = float(os.environ.get('LIVE_STREAM_SECONDS', 300))
+app.config['LIVE_QUEUE_SIZE'] = int(os.environ.get('LIVE_QUEUE_SIZE', 100))
+
+# Join codes are JOIN_CODE_LENGTH characters from JOIN_CODE_ALPHABET, which
+# must be upper case since codes are upper-cased when typed in. The default
+# leaves out look-alikes (0/O, 1/I/L) and gives 31^6, close to 900 million, codes.
+app.config['JOIN_CODE_LENGTH'] = int(os.environ.get('JOIN_CODE_LENGTH', 6))
+app.config['JOIN_CODE_ALPHABET'] = os.environ.get('JOIN_CODE_ALPHABET', 'ABCDEFGHJKMNPQRSTUVWXYZ23456789')
+
+# Limits on one bulk gift-list import, uploaded or pasted
+app.config['IMPORT_MAX_ITEMS'] = int(os.environ.get('IMPORT_MAX_ITEMS', 500))
+app.config['IMPORT_MAX_BYTES'] = int(os.environ.get('IMPORT_MAX_BYTES', 512 * 1024))
+
+# Rendered member gift tables kept per process for the group page, capped
+# by total HTML size
+app.config['FRAGMENT_CACHE_BYTES'] = int(os.environ.get('FRAGMENT_CACHE_BYTES', 32 * 1024 * 1024))
+
+# Groups whose gift exchange assignments are kept in memory per process
+app.config['EXCHANGE_CACHE_SIZE'] = int(os.environ.get('EXCHANGE_CACHE_SIZE', 256))
+
+# Output of `flask build-assets`: fingerprinted, precompressed copies of
+# app/static. Without a build, static files are served as they are.
+app.config['ASSET_BUILD_DIR'] = os.environ.get('ASSET_BUILD_DIR', os.path.join(app.instance_path, 'assets'))
+
+# Independent datastore reads within a request run concurrently on a pool of
+# FANOUT_WORKERS threads per process, at most FANOUT_PER_REQUEST at a time
+# for one request, which waits up to FANOUT_TIMEOUT seconds for them
+app.config['FANOUT_WORKERS'] = int(os.environ.get('FANOUT_WORKERS', 16))
+app.config['FANOUT_PER_REQUEST'] = int(os.environ.get('FANOUT_PER_REQUEST', 8))
+app.config['FANOUT_TIMEOUT'] = float(os.environ.get('FANOUT_TIMEOUT', 10))
+
+# Password hashes run on PASSWORD_HASH_WORKERS threads, with at most
+# PASSWORD_HASH_MAX_PENDING running or waiting. PASSWORD_HASH_METHOD is a
+# Werkzeug method string; users are rehashed at login when it changes.
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', 1))
+app.config['PASSWORD_HASH_MAX_PENDING'] = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 8))
+app.config['PASSWORD_HASH_TIMEOUT'] = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 5))
+
+# Login attempts allowed per client IP, and failed attempts per email, in
+# LOGIN_WINDOW_SECONDS (0 disables a limit). TRUSTED_PROXY_COUNT is the
+# number of proxies in front of the app whose X-Forwarded-For is trusted.
+# It must be set when deployed behind one (1 on Cloud Run, see
+# cloudrun.yaml): otherwise every client has the proxy's address and shares
+# one per-IP budget.
+app.config['LOGIN_LIMIT_PER_IP'] = int(os.environ.get('LOGIN_LIMIT_PER_IP', 30))
+app.config['LOGIN_LIMIT_PER_EMAIL'] = int(os.environ.get('LOGIN_LIMIT_PER_EMAIL', 5))
+app.config['LOGIN_WINDOW_SECONDS'] = float(os.environ.get('LOGIN_WINDOW_SECONDS', 300))
+app.config['TRUSTED_PROXY_COUNT'] = int(os.environ.get('TRUSTED_PROXY_COUNT', 0))
+if app.config['TRUSTED_PROXY_COUNT']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXY_COUNT'])
+
+# Resend API key, handed to the resend package on the first send so the
+# package is not imported at startup
+app.config['RESEND_API_KEY'] = os.environ.get('RESEND_API_KEY')
+
+# Outgoing email is queued and sent by background workers. MAIL_TRANSPORT
+# is resend, memory (kept in process, for tests and benchmarks) or file
+# (JSON lines appended to MAIL_FILE_PATH, for local development).
+app.config['MAIL_TRANSPORT'] = os.environ.get('MAIL_TRANSPORT', 'resend')
+app.config['MAIL_FILE_PATH'] = os.environ.get('MAIL_FILE_PATH', os.path.join(app.instance_path, 'mail.jsonl'))
+app.config['MAIL_LATENCY_MS'] = float(os.environ.get('MAIL_LATENCY_MS', 0))
+app.config['MAIL_WORKERS'] = int(os.environ.get('MAIL_WORKERS', 2))
+app.config['MAIL_QUEUE_SIZE'] = int(os.environ.get('MAIL_QUEUE_SIZE', 1000))
+app.config['MAIL_MAX_ATTEMPTS'] = int(os.environ.get('MAIL_MAX_ATTEMPTS', 5))
+app.config['MAIL_BACKOFF_SECONDS'] = float(os.environ.get('MAIL_BACKOFF_SECONDS', 1))
+app.config['MAIL_DRAIN_TIMEOUT'] = float(os.environ.get('MAIL_DRAIN_TIMEOUT', 10))
 
 # Initialize Flask-Login
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
-# Import routes to register them
-from app import routes
\ No newline at end of file
+from app.fanout import fan_out
+fan_out.configure(
+    workers=app.config['FANOUT_WORKERS'],
+    per_request=app.config['FANOUT_PER_REQUEST'],
+    timeout=app.config['FANOUT_TIMEOUT']
+)
+
+from app.passwords import email_throttle, ip_throttle, password_hasher
+password_hasher.configure(
+    method=app.config['PASSWORD_HASH_METHOD'],
+    workers=app.config['PASSWORD_HASH_WORKERS'],
+    max_pending=app.config['PASSWORD_HASH_MAX_PENDING'],
+    timeout=app.config['PASSWORD_HASH_TIMEOUT']
+)
+ip_throttle.configure(limit=app.config['LOGIN_LIMIT_PER_IP'], window=app.config['LOGIN_WINDOW_SECONDS'])
+email_throttle.configure(limit=app.config['LOGIN_LIMIT_PER_EMAIL'], window=app.config['LOGIN_WINDOW_SECONDS'])
+
+# Import routes and CLI commands to register them
+from app import routes, api, live, assets, commands, startup
+from app.live import live_hub
+live_hub.configure(
+    max_connections=app.config['LIVE_MAX_CONNECTIONS'],
+    idle_seconds=app.config['LIVE_IDLE_SECONDS'],
+    queue_size=app.config['LIVE_QUEUE_SIZE']
+)
+from app.models import exchange_cache, user_cache
+user_cache.configure(maxsize=app.config['USER_CACHE_SIZE'], ttl=app.config['USER_CACHE_TTL'])
+exchange_cache.configure(maxsize=app.config['EXCHANGE_CACHE_SIZE'])
+from app.fragments import fragment_cache
+fragment_cache.configure(maxbytes=app.config['FRAGMENT_CACHE_BYTES'])
+
+from app.mail import create_transport, email_queue
+email_queue.configure(
+    transport=create_transport(app.config),
+    workers=app.config['MAIL_WORKERS'],
+    maxsize=app.config['MAIL_QUEUE_SIZE'],
+    max_attempts=app.config['MAIL_MAX_ATTEMPTS'],
+    backoff=app.config['MAIL_BACKOFF_SECONDS'],
+    drain_timeout=app.config['MAIL_DRAIN_TIMEOUT']
+)
+
+# Time spent importing the app and its dependencies, reported by /warmup
+startup.startup_report['import_ms'] = round((time.perf_counter() - IMPORT_STARTED) * 1000, 3)
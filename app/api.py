@@ -0,0 +1,214 @@
+"""JSON API for groups, members, gift lists and claims.
+
+Every GET response carries a strong ETag built from the update_time of the
+group document and, for one group's members and gifts, the update_times of
+its snapshot shards, which every gift and membership write merges into. A
+request whose If-None-Match still matches gets a 304 after reading just the
+group, the caller's membership and the shards' metadata, without touching
+the gift_lists subcollection or any other member.
+"""
+from functools import wraps
+from hashlib import sha1
+from flask import jsonify, request
+from flask_login import current_user
+from app import app
+from app.models import User, Group, GiftList, GroupSnapshot, get_user_groups
+from app.models import ALREADY_CLAIMED, CLAIMED, CONTENDED, NOT_CLAIMER, NOT_FOUND, OWN_ITEM, UNCLAIMED
+
+# Bump when a response shape changes, so old ETags stop matching
+API_VERSION = '1'
+
+# HTTP status for each claim/unclaim result
+CLAIM_STATUS = {
+    CLAIMED: 200,
+    UNCLAIMED: 200,
+    ALREADY_CLAIMED: 409,
+    NOT_CLAIMER: 409,
+    CONTENDED: 409,
+    OWN_ITEM: 403,
+    NOT_FOUND: 404,
+}
+
+
+def api_login_required(view):
+    """Like login_required, but answers 401 instead of redirecting to the login page"""
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if not current_user.is_authenticated:
+            return error('login required', 401)
+        return view(*args, **kwargs)
+    return wrapped
+
+
+def error(message, status):
+    return jsonify(error=message), status
+
+
+def etag_for(*parts):
+    """Strong ETag for a representation of the given versions, per user"""
+    key = '|'.join(str(part) for part in (API_VERSION, current_user.id) + parts)
+    return sha1(key.encode()).hexdigest()[:20]
+
+
+def group_etag(group, *parts):
+    """ETag for a representation of the group's members or gifts
+    
+    The shards are read before anything else, so a response built from
+    later reads can only be newer than its ETag, never older.
+    """
+    return etag_for(group.id, group.update_time, *GroupSnapshot.get_update_times(group.id), *parts)
+
+
+def not_modified(etag):
+    """A 304 response if the client already has this ETag, otherwise None"""
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        _cache_headers(response, etag)
+        return response
+    return None
+
+
+def conditional_json(etag, data):
+    response = jsonify(data)
+    _cache_headers(response, etag)
+    return response
+
+
+def _cache_headers(response, etag):
+    response.set_etag(etag)
+    # Bodies depend on who is asking, and must be revalidated every time
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+
+
+def _load_group(group_id):
+    """The group if the current user is a member, otherwise None"""
+    group = Group.get(group_id)
+    if not group or not group.is_member(current_user.id):
+        return None
+    return group
+
+
+def _compact(data):
+    """Drop empty values to keep payloads small"""
+    return {key: value for key, value in data.items() if value not in (None, '', [], False)}
+
+
+def group_json(group, member_count=None):
+    return _compact({
+        'id': group.id,
+        'name': group.name,
+        'description': group.description,
+        'join_code': group.join_code,
+        'created_by': group.created_by,
+        'has_gift_exchange': group.has_gift_exchange,
+        'member_count': member_count,
+    })
+
+
+def member_json(user):
+    return _compact({
+        'id': user.id,
+        'first_name': user.first_name,
+        'last_name': user.last_name,
+    })
+
+
+def gift_json(gift, viewer_id=None):
+    viewer_id = viewer_id or current_user.id
+    data = {
+        'id': gift.id,
+        'user_id': gift.user_id,
+        'item_name': gift.item_name,
+        'description': gift.description,
+        'link': gift.link,
+    }
+    # Owners never learn whether their own gifts were claimed
+    if gift.user_id != viewer_id:
+        data['claimed'] = gift.is_claimed
+        data['claimed_by_me'] = gift.claimer_id == viewer_id
+    return _compact(data)
+
+
+@app.route('/api/groups')
+@api_login_required
+def api_groups():
+    groups = get_user_groups(current_user.id)
+    etag = etag_for(*sorted((group.id, group.update_time) for group in groups))
+    return not_modified(etag) or conditional_json(etag, {'groups': [group_json(group) for group in groups]})
+
+
+@app.route('/api/groups/<group_id>')
+@api_login_required
+def api_group(group_id):
+    group = _load_group(group_id)
+    if not group:
+        return error('group not found', 404)
+    etag = group_etag(group)
+    response = not_modified(etag)
+    if response:
+        return response
+    
+    data = group_json(group, member_count=group.count_members())
+    if group.has_gift_exchange:
+        receiver = group.get_gift_exchange_assignment(current_user.id)
+        if receiver:
+            data['buying_for'] = member_json(receiver)
+    return conditional_json(etag, data)
+
+
+@app.route('/api/groups/<group_id>/members')
+@api_login_required
+def api_members(group_id):
+    group = _load_group(group_id)
+    if not group:
+        return error('group not found', 404)
+    after = request.args.get('after')
+    limit = min(request.args.get('limit', app.config['GROUP_PAGE_SIZE'], type=int), 500)
+    etag = group_etag(group, after, limit)
+    response = not_modified(etag)
+    if response:
+        return response
+    
+    member_ids = group.get_member_ids_page(limit + 1, after)
+    data = {'members': [member_json(user) for user in User.get_many(member_ids[:limit])]}
+    if len(member_ids) > limit:
+        data['next'] = member_ids[limit - 1]
+    return conditional_json(etag, data)
+
+
+@app.route('/api/groups/<group_id>/gifts')
+@api_login_required
+def api_gifts(group_id):
+    group = _load_group(group_id)
+    if not group:
+        return error('group not found', 404)
+    user_id = request.args.get('user_id')
+    etag = group_etag(group, user_id)
+    response = not_modified(etag)
+    if response:
+        return response
+    
+    if user_id:
+        gifts = GiftList.get_by_user(group.id, user_id)
+    else:
+        gifts = GiftList.get_all_in_group(group.id)
+    return conditional_json(etag, {'gifts': [gift_json(gift) for gift in gifts]})
+
+
+@app.route('/api/groups/<group_id>/gifts/<gift_id>/claim', methods=['POST', 'DELETE'])
+@api_login_required
+def api_claim(group_id, gift_id):
+    if not _load_group(group_id):
+        return error('group not found', 404)
+    gift = GiftList.get(group_id, gift_id)
+    if not gift:
+        return error('gift not found', 404)
+    
+    if request.method == 'POST':
+        result = gift.claim(current_user.id)
+    else:
+        result = gift.unclaim(current_user.id)
+    if result == NOT_FOUND:
+        return error('gift not found', 404)
+    return jsonify(result=result, gift=gift_json(gift)), CLAIM_STATUS[result]
@@ -0,0 +1,219 @@
+"""Fingerprinted, precompressed static assets.
+
+``flask --app run build-assets`` copies every file in app/static to
+ASSET_BUILD_DIR under a name that includes a hash of its contents
+(``styles.css`` becomes ``styles.3f9c1a2b7d.css``). Alongside each copy it
+writes a gzip variant, a brotli one when the ``brotli`` package is
+installed, and for PNG and JPEG images an optimized recompression and a
+WebP variant when Pillow is installed. A variant is kept only when it is
+smaller. ``url(/static/...)`` references in CSS are rewritten to the hashed
+names, and everything is listed in manifest.json.
+
+When a manifest exists, ``url_for('static', filename=...)`` returns the
+hashed URL. Hashed files are served with the best variant the browser
+accepts and a one-year immutable Cache-Control, since their contents can
+never change under that name. Anything not in the manifest, and every file
+when no build has been run, falls back to Flask's own static handler.
+"""
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import re
+import shutil
+from flask import request, send_file
+from app import app
+
+MANIFEST = 'manifest.json'
+
+# Types worth compressing; images are already compressed
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt', '.html', '.map'}
+IMAGES = {'.png', '.jpg', '.jpeg'}
+
+# Content-Encoding for each precompressed suffix, most preferred first
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+# url(...) in CSS pointing into /static/, with or without quotes
+CSS_URL = re.compile(r'''url\((['"]?)/static/([^'")?#]+)([^'")]*)\1\)''')
+
+
+def fingerprint(data):
+    return hashlib.sha256(data).hexdigest()[:10]
+
+
+def hashed_name(name, data):
+    """Name with a content hash before the extension"""
+    root, ext = os.path.splitext(name)
+    return f'{root}.{fingerprint(data)}{ext}'
+
+
+def build_assets(static_dir, build_dir):
+    """Fingerprint and precompress every file in static_dir, returning the manifest"""
+    names = []
+    for root, _, files in os.walk(static_dir):
+        for filename in files:
+            names.append(os.path.relpath(os.path.join(root, filename), static_dir).replace(os.sep, '/'))
+    # CSS goes last so its url() references can point at hashed names
+    names.sort(key=lambda name: (name.endswith('.css'), name))
+    
+    if os.path.isdir(build_dir):
+        shutil.rmtree(build_dir)
+    os.makedirs(build_dir)
+    manifest = {}
+    for name in names:
+        with open(os.path.join(static_dir, name), 'rb') as f:
+            data = f.read()
+        ext = os.path.splitext(name)[1].lower()
+        if ext == '.css':
+            data = _rewrite_css(data, manifest)
+        if ext in IMAGES:
+            data = _optimize_image(data, ext) or data
+        
+        entry = {'path': hashed_name(name, data), 'size': len(data), 'encodings': {}}
+        _write(build_dir, entry['path'], data)
+        if ext in COMPRESSIBLE:
+            for encoding, suffix in ENCODINGS:
+                compressed = _compress(data, encoding)
+                if compressed is not None and len(compressed) < len(data):
+                    _write(build_dir, entry['path'] + suffix, compressed)
+                    entry['encodings'][encoding] = len(compressed)
+        if ext in IMAGES:
+            webp = _to_webp(data)
+            if webp is not None and len(webp) < len(data):
+                entry['webp'] = hashed_name(os.path.splitext(name)[0] + '.webp', webp)
+                _write(build_dir, entry['webp'], webp)
+        manifest[name] = entry
+    
+    with open(os.path.join(build_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def _write(build_dir, name, data):
+    path = os.path.join(build_dir, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def _rewrite_css(data, manifest):
+    def replace(match):
+        quote, name, rest = match.groups()
+        entry = manifest.get(name)
+        if entry is None:
+            return match.group(0)
+        return f'url({quote}/static/{entry["path"]}{rest}{quote})'
+    return CSS_URL.sub(replace, data.decode('utf-8')).encode('utf-8')
+
+
+def _compress(data, encoding):
+    if encoding == 'gzip':
+        # mtime=0 so rebuilding the same file gives the same bytes
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli.compress(data, quality=11)
+
+
+def _optimize_image(data, ext):
+    """Losslessly recompressed image bytes if smaller, otherwise None"""
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    out = io.BytesIO()
+    with Image.open(io.BytesIO(data)) as image:
+        if ext == '.png':
+            image.save(out, 'PNG', optimize=True)
+        else:
+            image.save(out, 'JPEG', optimize=True, progressive=True, quality='keep')
+    return out.getvalue() if out.tell() < len(data) else None
+
+
+def _to_webp(data):
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    out = io.BytesIO()
+    with Image.open(io.BytesIO(data)) as image:
+        image.save(out, 'WEBP', quality=85, method=6)
+    return out.getvalue()
+
+
+class AssetManifest:
+    """The build's manifest, read once per process"""
+    
+    def __init__(self, build_dir):
+        self.build_dir = build_dir
+        self._entries = None
+        self._by_path = None
+    
+    def _load(self):
+        if self._entries is None:
+            path = os.path.join(self.build_dir, MANIFEST)
+            entries = {}
+            if os.path.exists(path):
+                with open(path) as f:
+                    entries = json.load(f)
+            self._by_path = {entry['path']: entry for entry in entries.values()}
+            self._entries = entries
+        return self._entries
+    
+    def url_name(self, filename):
+        """Hashed name for a static file, or None if it was not built"""
+        entry = self._load().get(filename)
+        return entry['path'] if entry else None
+    
+    def entry_for(self, path):
+        """Manifest entry for a hashed name, or None"""
+        self._load()
+        return self._by_path.get(path)
+
+
+assets = AssetManifest(app.config['ASSET_BUILD_DIR'])
+
+
+@app.url_defaults
+def fingerprint_static_urls(endpoint, values):
+    if endpoint == 'static' and 'filename' in values:
+        values['filename'] = assets.url_name(values['filename']) or values['filename']
+
+
+def serve_static(filename):
+    """Serve a hashed asset with its best accepted variant, or fall back to Flask's handler"""
+    entry = assets.entry_for(filename)
+    if entry is None:
+        return app.send_static_file(filename)
+    
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    name, encoding, vary = entry['path'], None, []
+    if 'webp' in entry:
+        vary.append('Accept')
+        # Only an explicit image/webp counts; */* is sent by browsers without WebP too
+        if 'image/webp' in request.accept_mimetypes.values():
+            name, mimetype = entry['webp'], 'image/webp'
+    if entry['encodings']:
+        vary.append('Accept-Encoding')
+        for candidate, suffix in ENCODINGS:
+            if candidate in entry['encodings'] and request.accept_encodings[candidate]:
+                name, encoding = name + suffix, candidate
+                break
+    
+    response = send_file(os.path.join(assets.build_dir, name), mimetype=mimetype, conditional=True)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    for header in vary:
+        response.vary.add(header)
+    response.headers['Cache-Control'] = IMMUTABLE
+    return response
+
+
+# Replace the handler Flask registered for /static/<path:filename>
+app.view_functions['static'] = serve_static
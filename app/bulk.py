@@ -0,0 +1,164 @@
+"""Bulk gift-list import and export.
+
+Imports accept CSV or JSON, uploaded as a file or pasted into the My List
+page:
+
+- CSV: columns item_name, description, link. A header row naming them may
+  come first and may put them in any order; without one, columns are taken
+  in that order, so a pasted list of names is one item per line.
+- JSON: a list of objects with those keys, or ``{"gifts": [...]}`` as
+  written by the export.
+
+The whole file is checked before anything is written, and rejected with
+every problem listed if any row is invalid. Exports stream CSV or JSON rows
+as the gift query returns them.
+"""
+import csv
+import io
+import json
+from urllib.parse import urlparse
+
+FIELDS = ('item_name', 'description', 'link')
+EXPORT_COLUMNS = ('member', 'item_name', 'description', 'link', 'status')
+MAX_LENGTHS = {'item_name': 200, 'description': 2000, 'link': 2000}
+
+# Header spellings accepted for each field
+HEADER_ALIASES = {
+    'item_name': 'item_name', 'item name': 'item_name', 'item': 'item_name', 'name': 'item_name',
+    'description': 'description', 'notes': 'description',
+    'link': 'link', 'url': 'link',
+}
+
+# Spreadsheet apps run cells starting with these as formulas
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+class InvalidImport(ValueError):
+    """Raised when an import cannot be parsed or has invalid rows"""
+    
+    def __init__(self, errors):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+
+
+def parse_items(text, filename='', max_items=500):
+    """Parse and validate an import, returning (item_name, description, link) tuples"""
+    text = text.lstrip('\ufeff').strip()
+    if not text:
+        raise InvalidImport(['The import is empty.'])
+    if filename.lower().endswith('.json') or text[0] in '[{':
+        rows = _json_rows(text)
+    else:
+        rows = _csv_rows(text)
+    if len(rows) > max_items:
+        raise InvalidImport([f'Imports are limited to {max_items} items; this one has {len(rows)}.'])
+    
+    items = []
+    errors = []
+    for number, row in rows:
+        item, problems = _validate(row)
+        errors.extend(f'Row {number}: {problem}' for problem in problems)
+        items.append(item)
+    if errors:
+        raise InvalidImport(errors)
+    return items
+
+
+def _json_rows(text):
+    try:
+        data = json.loads(text)
+    except ValueError as e:
+        raise InvalidImport([f'Not valid JSON: {e}'])
+    if isinstance(data, dict):
+        data = data.get('gifts')
+    if not isinstance(data, list):
+        raise InvalidImport(['JSON must be a list of items or an object with a "gifts" list.'])
+    rows = []
+    for number, entry in enumerate(data, 1):
+        if not isinstance(entry, dict):
+            raise InvalidImport([f'Row {number}: each item must be an object.'])
+        rows.append((number, {field: entry.get(field) for field in FIELDS}))
+    return rows
+
+
+def _csv_rows(text):
+    reader = csv.reader(io.StringIO(text))
+    lines = [(reader.line_num, row) for row in reader if any(cell.strip() for cell in row)]
+    if not lines:
+        return []
+    header = [HEADER_ALIASES.get(cell.strip().lower()) for cell in lines[0][1]]
+    if 'item_name' in header:
+        lines = lines[1:]
+    else:
+        header = list(FIELDS)
+    rows = []
+    for number, row in lines:
+        rows.append((number, {field: value for field, value in zip(header, row) if field}))
+    return rows
+
+
+def _validate(row):
+    item = {}
+    problems = []
+    for field in FIELDS:
+        value = row.get(field)
+        value = '' if value is None else str(value).strip()
+        if len(value) > MAX_LENGTHS[field]:
+            problems.append(f'{field} is longer than {MAX_LENGTHS[field]} characters.')
+        item[field] = value
+    if not item['item_name']:
+        problems.append('item name is required.')
+    if item['link'] and urlparse(item['link']).scheme not in ('http', 'https'):
+        problems.append('link must start with http:// or https://.')
+    return (item['item_name'], item['description'], item['link']), problems
+
+
+def export_rows(gifts, owner_name, viewer_id):
+    """Export fields for each gift, with the claim state the viewer is allowed to see"""
+    for gift in gifts:
+        if gift.user_id == viewer_id:
+            status = ''
+        elif gift.claimer_id == viewer_id:
+            status = 'claimed by you'
+        else:
+            status = 'claimed' if gift.is_claimed else 'available'
+        yield {
+            'member': owner_name(gift.user_id),
+            'item_name': gift.item_name,
+            'description': gift.description,
+            'link': gift.link,
+            'status': status,
+        }
+
+
+def stream_csv(rows):
+    """Yield CSV text a row at a time, header first"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    
+    def line(values):
+        writer.writerow(values)
+        text = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return text
+    
+    yield line(EXPORT_COLUMNS)
+    for row in rows:
+        yield line([_neutralize(row[column]) for column in EXPORT_COLUMNS])
+
+
+def stream_json(rows):
+    """Yield a {"gifts": [...]} document an item at a time"""
+    yield '{"gifts": ['
+    separator = ''
+    for row in rows:
+        yield separator + json.dumps(row)
+        separator = ', '
+    yield ']}\n'
+
+
+def _neutralize(value):
+    # Keep spreadsheets from running user text as a formula
+    value = value or ''
+    return "'" + value if value.startswith(FORMULA_PREFIXES) else value
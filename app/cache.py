@@ -0,0 +1,126 @@
+from collections import OrderedDict
+from flask import g, has_request_context
+import threading
+import time
+
+# Returned by IdentityMap.get for keys that have not been loaded yet, since
+# None is a valid cached value meaning "document does not exist"
+MISSING = object()
+
+
+class IdentityMap:
+    """Per-request read-through cache of model objects, keyed by document path
+    
+    Fanned-out reads share their request's map from pool threads, so access
+    is locked. Loaders run outside the lock; two threads missing the same key
+    at once both load it and the last one wins.
+    """
+    
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key, default=MISSING):
+        """Get a cached value, counting the lookup as a hit or miss"""
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return default
+    
+    def load(self, key, loader):
+        """Get a cached value, calling loader() to fill it on a miss"""
+        value = self.get(key)
+        if value is MISSING:
+            value = loader()
+            self.put(key, value)
+        return value
+    
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+    
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+def identity_map():
+    """Get the current request's identity map, or None outside a request"""
+    if not has_request_context():
+        return None
+    if 'identity_map' not in g:
+        # setdefault, so pool threads racing to create the map share one
+        g.setdefault('identity_map', IdentityMap())
+    return g.identity_map
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire ttl seconds after being stored"""
+    
+    def __init__(self, maxsize=1024, ttl=60, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def configure(self, maxsize=None, ttl=None):
+        """Resize the cache or change its TTL, dropping entries that no longer fit"""
+        with self._lock:
+            if maxsize is not None:
+                self.maxsize = maxsize
+            if ttl is not None:
+                self.ttl = ttl
+            while len(self._entries) > max(self.maxsize, 0):
+                self._entries.popitem(last=False)
+    
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > self._clock():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return default
+    
+    def put(self, key, value):
+        with self._lock:
+            if self.maxsize <= 0:
+                return
+            self._entries[key] = (value, self._clock() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+    
+    def evict(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hit_rate,
+            }
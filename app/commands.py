@@ -0,0 +1,62 @@
+import click
+import os
+from app import app
+from app.assets import build_assets
+from app.models import backfill_email_index, backfill_join_codes, backfill_membership_index, migrate_gift_exchanges, rebuild_group_snapshots, recount_claims
+
+
+@app.cli.command('backfill-memberships')
+def backfill_memberships():
+    """Build the user -> groups membership index for existing groups"""
+    written = backfill_membership_index()
+    click.echo(f'Indexed {written} memberships.')
+
+
+@app.cli.command('backfill-emails')
+def backfill_emails():
+    """Build the unique email index for existing users"""
+    written, duplicates = backfill_email_index()
+    click.echo(f'Indexed {written} emails.')
+    for email in duplicates:
+        click.echo(f'Duplicate accounts for {email}; only one can log in.', err=True)
+
+
+@app.cli.command('backfill-join-codes')
+def backfill_join_codes_command():
+    """Reserve the join codes of existing groups"""
+    written, duplicates = backfill_join_codes()
+    click.echo(f'Reserved {written} join codes.')
+    for code in duplicates:
+        click.echo(f'Join code {code} is shared by several groups; only one can be joined with it.', err=True)
+
+
+@app.cli.command('recount-claims')
+@click.option('--group-id', 'group_ids', multiple=True, help='Only rebuild these groups.')
+def recount_claims_command(group_ids):
+    """Rebuild the per-claimer claim counters from the gift lists"""
+    count = recount_claims(list(group_ids) or None)
+    click.echo(f'Recounted claims in {count} groups.')
+
+
+@app.cli.command('rebuild-snapshots')
+@click.option('--group-id', 'group_ids', multiple=True, help='Only rebuild these groups.')
+def rebuild_snapshots_command(group_ids):
+    """Rebuild the group page snapshots from members and gift lists"""
+    count = rebuild_group_snapshots(list(group_ids) or None)
+    click.echo(f'Rebuilt snapshots of {count} groups.')
+
+
+@app.cli.command('migrate-gift-exchanges')
+def migrate_gift_exchanges_command():
+    """Key existing gift exchange assignments by giver"""
+    migrated = migrate_gift_exchanges()
+    click.echo(f'Migrated {migrated} gift exchange assignments.')
+
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Fingerprint and precompress the static files into ASSET_BUILD_DIR"""
+    manifest = build_assets(app.static_folder, app.config['ASSET_BUILD_DIR'])
+    before = sum(os.path.getsize(os.path.join(app.static_folder, name)) for name in manifest)
+    after = sum(min([entry['size']] + list(entry['encodings'].values())) for entry in manifest.values())
+    click.echo(f'Built {len(manifest)} assets into {app.config["ASSET_BUILD_DIR"]} ({before} -> {after} bytes compressed).')
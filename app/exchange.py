@@ -0,0 +1,116 @@
+"""Gift-exchange assignment: who buys a gift for whom.
+
+Every member gives exactly one gift and receives exactly one, and nobody
+draws themselves. Without exclusions the members are shuffled into a single
+random cycle, which is a valid assignment by construction and takes linear
+time. With exclusions (couples, last year's pairings, ...) the assignment is
+a perfect matching between givers and receivers over the allowed pairs,
+found with augmenting paths; if none exists ExchangeInfeasible is raised
+straight away rather than retrying shuffles.
+"""
+import random
+
+
+class ExchangeInfeasible(Exception):
+    """No assignment satisfies the group's exclusions"""
+
+
+def couples_to_exclusions(couples):
+    """Turn (a, b) couples into exclusions in both directions"""
+    for a, b in couples:
+        yield a, b
+        yield b, a
+
+
+def assign_gift_exchange(member_ids, exclusions=(), rng=None):
+    """Return a list of (giver_id, receiver_id) pairs covering every member
+    
+    exclusions is an iterable of (giver_id, receiver_id) pairs that must not
+    be drawn. Raises ExchangeInfeasible if no valid assignment exists.
+    """
+    rng = rng or random.SystemRandom()
+    members = list(dict.fromkeys(member_ids))
+    if len(members) < 2:
+        raise ExchangeInfeasible('A gift exchange needs at least 2 members')
+    
+    forbidden = {}
+    for giver_id, receiver_id in exclusions:
+        forbidden.setdefault(giver_id, set()).add(receiver_id)
+    
+    order = members[:]
+    rng.shuffle(order)
+    cycle = list(zip(order, order[1:] + order[:1]))
+    if all(receiver_id not in forbidden.get(giver_id, ()) for giver_id, receiver_id in cycle):
+        return cycle
+    return _match(order, forbidden, rng)
+
+
+def _match(members, forbidden, rng):
+    """Find a random perfect matching of givers to allowed receivers
+    
+    The allowed graph is nearly complete, so adjacency is implicit: every
+    receiver except the giver and their exclusions. A greedy pass matches
+    almost everyone, then each remaining giver is matched with a BFS for an
+    augmenting path. Each BFS visits every receiver at most once and only
+    re-checks excluded pairs, so it costs O(members + exclusions).
+    """
+    def allowed(giver_id, receiver_id):
+        return giver_id != receiver_id and receiver_id not in forbidden.get(giver_id, ())
+    
+    receiver_of = {}
+    giver_of = {}
+    
+    # Greedy pass over a shuffled receiver pool
+    pool = members[:]
+    rng.shuffle(pool)
+    unmatched = []
+    for giver_id in members:
+        for i in range(len(pool)):
+            if allowed(giver_id, pool[i]):
+                receiver_id = pool.pop(i)
+                receiver_of[giver_id] = receiver_id
+                giver_of[receiver_id] = giver_id
+                break
+        else:
+            unmatched.append(giver_id)
+    
+    for start in unmatched:
+        unvisited = members[:]
+        rng.shuffle(unvisited)
+        # receiver -> giver that reached it, to walk the path back
+        reached_from = {}
+        queue = [start]
+        free_receiver = None
+        while queue and free_receiver is None:
+            next_queue = []
+            for giver_id in queue:
+                remaining = []
+                for receiver_id in unvisited:
+                    if free_receiver is not None or not allowed(giver_id, receiver_id):
+                        remaining.append(receiver_id)
+                        continue
+                    reached_from[receiver_id] = giver_id
+                    if receiver_id not in giver_of:
+                        free_receiver = receiver_id
+                    else:
+                        next_queue.append(giver_of[receiver_id])
+                unvisited = remaining
+                if free_receiver is not None:
+                    break
+            queue = next_queue
+        
+        if free_receiver is None:
+            raise ExchangeInfeasible('No assignment satisfies the exclusions')
+        
+        # Flip the matching along the augmenting path
+        receiver_id = free_receiver
+        while True:
+            giver_id = reached_from[receiver_id]
+            previous = receiver_of.get(giver_id)
+            receiver_of[giver_id] = receiver_id
+            giver_of[receiver_id] = giver_id
+            if giver_id == start:
+                break
+            receiver_id = previous
+    
+    return [(giver_id, receiver_of[giver_id]) for giver_id in members]
@@ -0,0 +1,104 @@
+"""Concurrent datastore reads within a request.
+
+Reads that do not depend on each other (one query per group on the
+dashboard, one get_all per chunk of IDs) used to run one after another, so
+a page took the sum of their round trips. ``fan_out.run(calls)`` runs them
+on a shared thread pool instead, and the page takes about as long as the
+slowest one.
+
+Each call runs in a copy of the caller's context, so Flask's ``g``,
+``current_user``, the request's identity map and datastore trace all work
+as they do on the request thread. At most FANOUT_PER_REQUEST calls from one
+``run`` are in flight at once, the pool has FANOUT_WORKERS threads shared
+by the whole process, and the caller waits at most FANOUT_TIMEOUT seconds
+before FanOutTimeout is raised. Calls made from inside a fanned-out call
+run inline, so nested fan-outs cannot starve the pool.
+"""
+import contextvars
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from app.process_local import ProcessLocal
+
+# True on a pool thread while it runs a fanned-out call
+_in_fan_out = contextvars.ContextVar('in_fan_out', default=False)
+
+# The frame that called run, seen from a pool thread, so code that walks the
+# call stack (app.instrumentation) can carry on past where the thread began
+caller_frame = contextvars.ContextVar('fan_out_caller_frame', default=None)
+
+
+class FanOutTimeout(Exception):
+    """Raised when fanned-out calls do not all finish within the timeout"""
+
+
+class FanOut:
+    def __init__(self, workers=16, per_request=8, timeout=10.0):
+        self._executor = ProcessLocal(lambda: ThreadPoolExecutor(self.workers, thread_name_prefix='fan-out'))
+        self.configure(workers, per_request, timeout)
+    
+    def configure(self, workers=None, per_request=None, timeout=None):
+        """Change settings before the first call"""
+        if workers is not None:
+            self.workers = workers
+        if per_request is not None:
+            self.per_request = per_request
+        if timeout is not None:
+            self.timeout = timeout
+    
+    def start(self):
+        """Start this process's thread pool ahead of the first call"""
+        self._executor.get()
+    
+    def map(self, fn, items):
+        """Call fn on every item concurrently, returning the results in order"""
+        return self.run([lambda item=item: fn(item) for item in items])
+    
+    def run(self, calls):
+        """Call every zero-argument callable concurrently, returning the results in order
+        
+        The first exception raised by a call is raised here once it is seen.
+        """
+        calls = list(calls)
+        if len(calls) <= 1 or self.per_request <= 1 or self.workers <= 1 or _in_fan_out.get():
+            return [call() for call in calls]
+        
+        pool = self._executor.get()
+        frame_token = caller_frame.set(sys._getframe(1))
+        deadline = time.monotonic() + self.timeout
+        results = [None] * len(calls)
+        waiting = iter(enumerate(calls))
+        pending = {}
+        
+        def submit_next():
+            for index, call in waiting:
+                # A context can only be entered by one thread at a time, so
+                # every call gets its own copy
+                context = contextvars.copy_context()
+                pending[pool.submit(context.run, _call, call)] = index
+                return
+        
+        try:
+            for _ in range(self.per_request):
+                submit_next()
+            while pending:
+                done, _ = wait(pending, max(0, deadline - time.monotonic()), FIRST_COMPLETED)
+                if not done:
+                    raise FanOutTimeout(f'{len(pending)} of {len(calls)} calls still running')
+                for future in done:
+                    results[pending.pop(future)] = future.result()
+                    submit_next()
+        finally:
+            # Calls not started yet are dropped; running ones finish on their own
+            for future in pending:
+                future.cancel()
+            caller_frame.reset(frame_token)
+        return results
+
+
+def _call(call):
+    _in_fan_out.set(True)
+    return call()
+
+
+fan_out = FanOut()
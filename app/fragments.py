@@ -0,0 +1,130 @@
+"""Render cache for the gift tables on the group page.
+
+A member's gift table looks the same to every viewer except for the
+Status and Action cells, which depend on whether the viewer claimed the
+gift. So the table is rendered once per (group, member, version), with
+each gift's two cells left as a slot, and both ways the cells can look
+rendered alongside: as seen by the gift's claimer, and by everyone else.
+Serving a viewer then only joins strings. The version is the member's
+stamp in the group snapshot, bumped by every write to their names or
+gifts, so a stale table is never served.
+
+Tables are kept in an LRU bounded by the total size of their HTML,
+FRAGMENT_CACHE_BYTES per process.
+"""
+import threading
+from collections import OrderedDict
+from flask import get_template_attribute, render_template
+from markupsafe import Markup
+
+# Stands in for a gift's Status and Action cells in a cached table. Gift
+# fields are HTML-escaped, so they can never contain it.
+CLAIM_SLOT = Markup('<!--claim-slot-->')
+
+
+class GiftTable:
+    """A rendered gift table with a claim slot per gift"""
+    
+    def __init__(self, pieces, slots):
+        # Static HTML around the slots; one more piece than slots
+        self.pieces = pieces
+        # (claimer_id, cells as seen by the claimer, cells as seen by others)
+        self.slots = slots
+        self.size = sum(len(piece) for piece in pieces) + sum(len(mine) + len(other) for _, mine, other in slots)
+    
+    def render(self, viewer_id):
+        """The table's HTML as the viewer should see it"""
+        parts = [self.pieces[0]]
+        for (claimer_id, mine, other), piece in zip(self.slots, self.pieces[1:]):
+            parts.append(mine if claimer_id == viewer_id else other)
+            parts.append(piece)
+        return Markup(''.join(parts))
+
+
+class FragmentCache:
+    """Thread-safe LRU cache bounded by the total size of its entries"""
+    
+    def __init__(self, maxbytes=32 * 1024 * 1024):
+        self.maxbytes = maxbytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def configure(self, maxbytes=None):
+        """Change the size limit"""
+        with self._lock:
+            if maxbytes is not None:
+                self.maxbytes = maxbytes
+            self._evict()
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+    
+    def put(self, key, entry):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old.size
+            if entry.size > self.maxbytes:
+                return
+            self._entries[key] = entry
+            self.bytes += entry.size
+            self._evict()
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+    
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+    
+    def _evict(self):
+        while self.bytes > self.maxbytes:
+            _, entry = self._entries.popitem(last=False)
+            self.bytes -= entry.size
+
+
+fragment_cache = FragmentCache()
+
+
+def render_gift_table(group_id, gifts):
+    """Render a member's gift table with a claim slot per gift"""
+    pieces = render_template('_gift_table.html', group_id=group_id, gifts=gifts, claim_slot=CLAIM_SLOT).split(CLAIM_SLOT)
+    claim_cells = get_template_attribute('_gift_table.html', 'claim_cells')
+    slots = []
+    for gift in gifts:
+        other = str(claim_cells(group_id, gift, False))
+        # Only the claimer sees a claimed gift differently
+        mine = str(claim_cells(group_id, gift, True)) if gift.claimer_id else other
+        slots.append((gift.claimer_id, mine, other))
+    return GiftTable(pieces, slots)
+
+
+def gift_table_html(group_id, member_id, version, gifts, viewer_id):
+    """A member's gift table for the viewer, from the cache when the member's version matches"""
+    if version is None:
+        return render_gift_table(group_id, gifts).render(viewer_id)
+    key = (group_id, member_id, version)
+    table = fragment_cache.get(key)
+    if table is None:
+        table = render_gift_table(group_id, gifts)
+        fragment_cache.put(key, table)
+    return table.render(viewer_id)
@@ -0,0 +1,321 @@
+"""Per-request datastore instrumentation.
+
+``instrument(client)`` wraps the datastore client used by app.models and
+records every RPC it issues: point reads, batched reads, queries, writes and
+batch commits, with the number of documents involved, wall time and the
+app.models method that triggered it. At the end of each request the totals
+are sent as a ``Server-Timing`` header and logged as one JSON line; requests
+slower than SLOW_REQUEST_MS also log the full RPC trace.
+"""
+from flask import g, has_request_context, request
+from app import app
+from app.fanout import caller_frame
+import json
+import logging
+import sys
+import time
+
+MODELS_MODULE = 'app.models'
+
+# One JSON object per line on stdout, which Cloud Logging parses as a
+# structured entry
+logger = logging.getLogger('app.datastore')
+if not logger.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+class RequestTrace:
+    """Datastore RPCs issued while handling one request"""
+    
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.rpcs = []
+    
+    def record(self, kind, path, docs, duration_ms):
+        self.rpcs.append({
+            'kind': kind,
+            'path': path,
+            'docs': docs,
+            'ms': round(duration_ms, 3),
+            'method': _calling_model_method(),
+        })
+    
+    def totals(self):
+        """Summarize RPCs by kind and by model method"""
+        by_kind = {}
+        by_method = {}
+        for rpc in self.rpcs:
+            for key, table in ((rpc['kind'], by_kind), (rpc['method'] or 'other', by_method)):
+                entry = table.setdefault(key, {'count': 0, 'docs': 0, 'ms': 0.0})
+                entry['count'] += 1
+                entry['docs'] += rpc['docs']
+                entry['ms'] = round(entry['ms'] + rpc['ms'], 3)
+        return {
+            'rpcs': len(self.rpcs),
+            'docs': sum(rpc['docs'] for rpc in self.rpcs),
+            'ms': round(sum(rpc['ms'] for rpc in self.rpcs), 3),
+            'by_kind': by_kind,
+            'by_method': by_method,
+        }
+
+
+def current_trace():
+    """Get the trace for the current request, or None outside one"""
+    if not has_request_context():
+        return None
+    return g.get('datastore_trace')
+
+
+def _calling_model_method():
+    """Name the outermost public app.models function on the call stack
+    
+    On a fan-out pool thread the stack ends where the thread picked up the
+    call, so the walk carries on from the frame that called fan_out.run.
+    """
+    frame = sys._getframe(2)
+    origin = caller_frame.get()
+    method = None
+    while frame is not None:
+        if frame.f_globals.get('__name__') == MODELS_MODULE:
+            name = frame.f_code.co_qualname.split('.<locals>')[0]
+            if not name.rsplit('.', 1)[-1].startswith('_'):
+                method = name
+        frame = frame.f_back
+        if frame is None:
+            frame, origin = origin, None
+    return method
+
+
+def _unwrap(value):
+    if isinstance(value, dict):
+        # Cursors like {'__name__': reference}
+        return {key: _unwrap(item) for key, item in value.items()}
+    return value._target if isinstance(value, _Instrumented) else value
+
+
+def _record(kind, path, docs, started):
+    trace = current_trace()
+    if trace is not None:
+        trace.record(kind, path, docs, (time.perf_counter() - started) * 1000)
+
+
+def _timed_stream(documents, kind, path):
+    """Yield from a document stream, timing only the time spent fetching"""
+    trace = current_trace()
+    elapsed = 0.0
+    docs = 0
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                doc = next(documents)
+            except StopIteration:
+                break
+            finally:
+                elapsed += time.perf_counter() - started
+            docs += 1
+            yield doc
+    finally:
+        if trace is not None:
+            trace.record(kind, path, docs, elapsed * 1000)
+
+
+class _Instrumented:
+    """Base proxy: anything not instrumented is passed through to the target"""
+    
+    def __init__(self, target):
+        self._target = target
+    
+    def __getattr__(self, name):
+        return getattr(self._target, name)
+
+
+class _DocumentReference(_Instrumented):
+    @property
+    def parent(self):
+        return _Query(self._target.parent)
+    
+    def collection(self, collection_id):
+        return _Query(self._target.collection(collection_id))
+    
+    def get(self, *args, **kwargs):
+        started = time.perf_counter()
+        snapshot = self._target.get(*args, **kwargs)
+        _record('get', self._target.path, 1, started)
+        return snapshot
+    
+    def _write(self, method, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return getattr(self._target, method)(*args, **kwargs)
+        finally:
+            _record('write', self._target.path, 1, started)
+    
+    def create(self, *args, **kwargs):
+        return self._write('create', *args, **kwargs)
+    
+    def set(self, *args, **kwargs):
+        return self._write('set', *args, **kwargs)
+    
+    def update(self, *args, **kwargs):
+        return self._write('update', *args, **kwargs)
+    
+    def delete(self, *args, **kwargs):
+        return self._write('delete', *args, **kwargs)
+
+
+class _Query(_Instrumented):
+    """Collection references and queries"""
+    
+    def _path(self):
+        path = getattr(self._target, '_path', None)
+        if path:
+            return '/'.join(path)
+        return getattr(self._target, '_collection_id', None) or 'query'
+    
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name in ('where', 'order_by', 'limit', 'limit_to_last', 'offset', 'select',
+                    'start_at', 'start_after', 'end_at', 'end_before'):
+            def build(*args, **kwargs):
+                args = [_unwrap(arg) for arg in args]
+                kwargs = {key: _unwrap(value) for key, value in kwargs.items()}
+                return _Query(attr(*args, **kwargs))
+            return build
+        return attr
+    
+    def document(self, *args, **kwargs):
+        return _DocumentReference(self._target.document(*args, **kwargs))
+    
+    def stream(self, *args, **kwargs):
+        return _timed_stream(iter(self._target.stream(*args, **kwargs)), 'query', self._path())
+    
+    def get(self, *args, **kwargs):
+        return list(self.stream(*args, **kwargs))
+    
+    def count(self, *args, **kwargs):
+        return _Aggregation(self._target.count(*args, **kwargs), self._path())
+    
+    def add(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._target.add(*args, **kwargs)
+        finally:
+            _record('write', self._path(), 1, started)
+
+
+class _Aggregation(_Instrumented):
+    def __init__(self, target, path):
+        super().__init__(target)
+        self._path = path
+    
+    def get(self, *args, **kwargs):
+        started = time.perf_counter()
+        result = self._target.get(*args, **kwargs)
+        _record('count', self._path, 1, started)
+        return result
+
+
+class _WriteBatch(_Instrumented):
+    def __len__(self):
+        return len(self._target)
+    
+    def create(self, reference, *args, **kwargs):
+        self._target.create(_unwrap(reference), *args, **kwargs)
+    
+    def set(self, reference, *args, **kwargs):
+        self._target.set(_unwrap(reference), *args, **kwargs)
+    
+    def update(self, reference, *args, **kwargs):
+        self._target.update(_unwrap(reference), *args, **kwargs)
+    
+    def delete(self, reference, *args, **kwargs):
+        self._target.delete(_unwrap(reference), *args, **kwargs)
+    
+    def commit(self, *args, **kwargs):
+        writes = len(self._target)
+        started = time.perf_counter()
+        try:
+            return self._target.commit(*args, **kwargs)
+        finally:
+            _record('commit', 'batch', writes, started)
+
+
+class InstrumentedClient(_Instrumented):
+    def collection(self, *args, **kwargs):
+        return _Query(self._target.collection(*args, **kwargs))
+    
+    def collection_group(self, *args, **kwargs):
+        return _Query(self._target.collection_group(*args, **kwargs))
+    
+    def document(self, *args, **kwargs):
+        return _DocumentReference(self._target.document(*args, **kwargs))
+    
+    def batch(self):
+        return _WriteBatch(self._target.batch())
+    
+    def get_all(self, references, *args, **kwargs):
+        references = [_unwrap(reference) for reference in references]
+        path = references[0].parent.id if references else 'get_all'
+        return _timed_stream(iter(self._target.get_all(references, *args, **kwargs)), 'get_all', path)
+
+
+def instrument(client):
+    """Wrap a datastore client so its RPCs are recorded per request"""
+    if not app.config.get('DATASTORE_INSTRUMENTATION', True):
+        return client
+    return InstrumentedClient(client)
+
+
+def server_timing(trace, total_ms):
+    """Format a Server-Timing header value from a request trace"""
+    totals = trace.totals()
+    metrics = [f'app;dur={total_ms:.1f}']
+    metrics.append(f'db;dur={totals["ms"]:.1f};desc="{totals["rpcs"]} RPCs, {totals["docs"]} docs"')
+    for kind, entry in sorted(totals['by_kind'].items()):
+        metrics.append(f'db-{kind};dur={entry["ms"]:.1f};desc="{entry["count"]} RPCs, {entry["docs"]} docs"')
+    return ', '.join(metrics)
+
+
+@app.before_request
+def start_datastore_trace():
+    g.datastore_trace = RequestTrace()
+
+
+@app.after_request
+def report_datastore_trace(response):
+    trace = g.get('datastore_trace')
+    if trace is None:
+        return response
+    total_ms = (time.perf_counter() - trace.started) * 1000
+    # For a streamed response this only covers the time to the headers
+    response.headers['Server-Timing'] = server_timing(trace, total_ms)
+    
+    if app.config.get('DATASTORE_LOG', True):
+        method, path, endpoint = request.method, request.path, request.endpoint
+        if response.is_streamed:
+            # RPCs keep arriving while the body streams, so log once it is sent
+            response.call_on_close(lambda: _log_trace(trace, method, path, endpoint, response.status_code))
+        else:
+            _log_trace(trace, method, path, endpoint, response.status_code)
+    return response
+
+
+def _log_trace(trace, method, path, endpoint, status):
+    total_ms = (time.perf_counter() - trace.started) * 1000
+    slow = total_ms >= app.config.get('SLOW_REQUEST_MS', 1000)
+    entry = {
+        'severity': 'WARNING' if slow else 'INFO',
+        'message': f'{method} {path} {status} {total_ms:.1f}ms',
+        'endpoint': endpoint,
+        'status': status,
+        'duration_ms': round(total_ms, 3),
+        'datastore': trace.totals(),
+    }
+    if slow:
+        entry['datastore_trace'] = trace.rpcs
+    logger.info(json.dumps(entry, default=str))
@@ -0,0 +1,226 @@
+"""Live gift updates over Server-Sent Events.
+
+Each worker process keeps at most one snapshot listener per group, on the
+group's gift_lists subcollection, shared by every browser watching that
+group through this worker. Changes fan out to per-connection queues, and
+each connection formats them for its viewer. A feed with no subscribers is
+torn down after LIVE_IDLE_SECONDS. Connections are capped at
+LIVE_MAX_CONNECTIONS per worker and closed after LIVE_STREAM_SECONDS
+(browsers reconnect on their own). A comment line goes out every
+LIVE_HEARTBEAT_SECONDS so proxies keep idle streams open.
+"""
+import json
+import queue
+import threading
+import time
+from flask import Response, abort, stream_with_context
+from flask_login import current_user, login_required
+from app import app
+from app import models
+from app.models import Group, GiftList
+from app.api import gift_json
+
+# Closes a connection's stream
+_CLOSE = object()
+
+# How long browsers wait before reconnecting a closed stream
+RECONNECT_MS = 3000
+
+
+class LiveCapacityError(Exception):
+    """Raised when the worker already has LIVE_MAX_CONNECTIONS open streams"""
+
+
+class Subscriber:
+    def __init__(self, group_id, viewer_id, maxsize):
+        self.group_id = group_id
+        self.viewer_id = viewer_id
+        self.events = queue.Queue(maxsize)
+        # Set when events were dropped, so the browser should reload instead
+        self.lagged = False
+    
+    def publish(self, event):
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            self.lagged = True
+
+
+class GroupFeed:
+    def __init__(self, group_id):
+        self.group_id = group_id
+        self.subscribers = set()
+        self.idle_timer = None
+        self._ready = False
+        self._watch = models.db.collection('groups').document(group_id).collection('gift_lists').on_snapshot(self._on_snapshot)
+    
+    def close(self):
+        self._watch.unsubscribe()
+        for subscriber in list(self.subscribers):
+            subscriber.publish(_CLOSE)
+    
+    def _on_snapshot(self, docs, changes, read_time):
+        # The first snapshot is the current state, which pages already show
+        if not self._ready:
+            self._ready = True
+            return
+        for change in changes:
+            doc = change.document
+            gift = GiftList(doc.id, self.group_id, doc.to_dict(), doc.update_time)
+            event = (change.type.name.lower(), gift)
+            for subscriber in list(self.subscribers):
+                subscriber.publish(event)
+
+
+class LiveHub:
+    def __init__(self, max_connections=100, idle_seconds=30, queue_size=100):
+        self.max_connections = max_connections
+        self.idle_seconds = idle_seconds
+        self.queue_size = queue_size
+        self.feeds = {}
+        self.connections = 0
+        self._lock = threading.Lock()
+    
+    def configure(self, max_connections=None, idle_seconds=None, queue_size=None):
+        """Change limits"""
+        if max_connections is not None:
+            self.max_connections = max_connections
+        if idle_seconds is not None:
+            self.idle_seconds = idle_seconds
+        if queue_size is not None:
+            self.queue_size = queue_size
+    
+    def subscribe(self, group_id, viewer_id):
+        """Start receiving a group's gift changes, sharing its listener if one is open"""
+        subscriber = Subscriber(group_id, viewer_id, self.queue_size)
+        with self._lock:
+            if self.connections >= self.max_connections:
+                raise LiveCapacityError()
+            # Hold the slot while a new listener opens outside the lock
+            self.connections += 1
+            if self._attach(group_id, subscriber):
+                return subscriber
+        
+        # Opening a listener is a network call, so other subscribes, reaps
+        # and stats must not wait on it
+        try:
+            new_feed = GroupFeed(group_id)
+        except BaseException:
+            with self._lock:
+                self.connections -= 1
+            raise
+        with self._lock:
+            if not self._attach(group_id, subscriber):
+                self.feeds[group_id] = new_feed
+                new_feed.subscribers.add(subscriber)
+                return subscriber
+        # Another subscriber opened the group's listener first
+        new_feed.close()
+        return subscriber
+    
+    def _attach(self, group_id, subscriber):
+        """Add the subscriber to the group's open feed, returning False if there is none"""
+        feed = self.feeds.get(group_id)
+        if feed is None:
+            return False
+        if feed.idle_timer is not None:
+            feed.idle_timer.cancel()
+            feed.idle_timer = None
+        feed.subscribers.add(subscriber)
+        return True
+    
+    def unsubscribe(self, subscriber):
+        """Stop a subscription, tearing the listener down once the feed stays idle"""
+        with self._lock:
+            feed = self.feeds.get(subscriber.group_id)
+            if feed is None or subscriber not in feed.subscribers:
+                return
+            feed.subscribers.discard(subscriber)
+            self.connections -= 1
+            if not feed.subscribers and feed.idle_timer is None:
+                feed.idle_timer = threading.Timer(self.idle_seconds, self._reap, (feed,))
+                feed.idle_timer.daemon = True
+                feed.idle_timer.start()
+    
+    def close(self):
+        """Stop every listener and end every stream"""
+        with self._lock:
+            feeds, self.feeds = list(self.feeds.values()), {}
+            self.connections = 0
+        for feed in feeds:
+            if feed.idle_timer is not None:
+                feed.idle_timer.cancel()
+            feed.close()
+    
+    def stats(self):
+        with self._lock:
+            return {'feeds': len(self.feeds), 'connections': self.connections}
+    
+    def _reap(self, feed):
+        with self._lock:
+            if feed.subscribers or self.feeds.get(feed.group_id) is not feed:
+                return
+            del self.feeds[feed.group_id]
+        feed.close()
+
+
+# One hub per worker process. Configured from the LIVE_* settings in
+# app/__init__.py.
+live_hub = LiveHub()
+
+
+def format_event(subscriber, event):
+    """Render a change as an SSE message for the subscriber, or None to skip it"""
+    change, gift = event
+    # Owners must not learn that their own gift was just claimed
+    if gift.user_id == subscriber.viewer_id and change == 'modified':
+        return None
+    data = {'change': change, 'gift': gift_json(gift, subscriber.viewer_id)}
+    return f'event: gift\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'
+
+
+def event_stream(subscriber, heartbeat, lifetime):
+    """Yield SSE messages until the stream's lifetime is up or the client goes away"""
+    deadline = time.monotonic() + lifetime
+    try:
+        yield f'retry: {RECONNECT_MS}\n\n'
+        while time.monotonic() < deadline:
+            if subscriber.lagged:
+                yield 'event: reload\ndata: {}\n\n'
+                return
+            try:
+                event = subscriber.events.get(timeout=min(heartbeat, max(0, deadline - time.monotonic())))
+            except queue.Empty:
+                yield ': heartbeat\n\n'
+                continue
+            if event is _CLOSE:
+                return
+            message = format_event(subscriber, event)
+            if message:
+                yield message
+    finally:
+        live_hub.unsubscribe(subscriber)
+
+
+@app.route('/group/<group_id>/events')
+@login_required
+def group_events(group_id):
+    group = Group.get(group_id)
+    if not group or not group.is_member(current_user.id):
+        abort(404)
+    try:
+        subscriber = live_hub.subscribe(group.id, current_user.id)
+    except LiveCapacityError:
+        # EventSource gives up on a non-200 answer; live.js tries again later
+        return Response('too many live connections\n', status=503, headers={'Retry-After': '30'})
+    
+    stream = event_stream(subscriber, app.config['LIVE_HEARTBEAT_SECONDS'], app.config['LIVE_STREAM_SECONDS'])
+    response = Response(stream_with_context(stream), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        # Stop nginx-style proxies from buffering the stream
+        'X-Accel-Buffering': 'no',
+    })
+    # The generator's cleanup never runs if the client leaves before the
+    # first message, so release the slot when the server closes the response
+    response.call_on_close(lambda: live_hub.unsubscribe(subscriber))
+    return response
@@ -0,0 +1,265 @@
+"""Background email dispatch.
+
+Requests hand messages to an EmailQueue and return straight away. A small
+pool of worker threads delivers them through a transport. Failed sends wait
+out an exponential backoff on a delay heap, from which one scheduler thread
+puts them back on the queue when they are due, so no worker sits idle
+waiting for a retry. Messages that still fail after
+MAIL_MAX_ATTEMPTS, or that arrive while the queue is full, are logged as
+dead letters on the 'app.mail' logger.
+
+Transports:
+
+- ResendTransport sends through the Resend API (production)
+- MemoryTransport keeps sent messages in a list, for tests and benchmarks
+- FileTransport appends each message as a JSON line to a file
+"""
+import atexit
+import heapq
+import itertools
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from app.process_local import ProcessLocal
+
+logger = logging.getLogger('app.mail')
+
+DEFAULT_SENDER = 'Giftster <noreply@mail.giftster.app>'
+
+# Marks the end of the queue for a worker thread
+_STOP = object()
+
+
+class TransportError(Exception):
+    """Raised by a transport when a message could not be delivered"""
+
+
+class ResendTransport:
+    def __init__(self, api_key=None):
+        self.api_key = api_key
+    
+    def send(self, message):
+        """Send a message through the Resend API"""
+        import resend
+        if self.api_key:
+            resend.api_key = self.api_key
+        try:
+            resend.Emails.send(message)
+        except Exception as e:
+            raise TransportError(str(e)) from e
+
+
+class MemoryTransport:
+    def __init__(self, latency=0, failure_rate=0, rng=None):
+        # Simulated provider round trip and share of sends that fail, so
+        # throughput and retries can be measured offline
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.rng = rng or random.Random()
+        self.sent = []
+        self._lock = threading.Lock()
+    
+    def send(self, message):
+        """Keep the message in memory"""
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            if self.failure_rate and self.rng.random() < self.failure_rate:
+                raise TransportError('simulated failure')
+            self.sent.append(message)
+
+
+class FileTransport:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+    
+    def send(self, message):
+        """Append the message to the file as one JSON line"""
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(message) + '\n')
+
+
+def create_transport(config):
+    """Build the transport named by MAIL_TRANSPORT"""
+    name = config['MAIL_TRANSPORT']
+    if name == 'resend':
+        return ResendTransport(config.get('RESEND_API_KEY'))
+    if name == 'memory':
+        return MemoryTransport(latency=config.get('MAIL_LATENCY_MS', 0) / 1000)
+    if name == 'file':
+        return FileTransport(config['MAIL_FILE_PATH'])
+    raise ValueError(f'Unknown MAIL_TRANSPORT: {name!r}')
+
+
+class EmailQueue:
+    def __init__(self, transport=None, workers=2, maxsize=1000, max_attempts=5, backoff=1.0, drain_timeout=10):
+        self.transport = transport
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self._queue = queue.Queue(maxsize)
+        # (not_before, sequence, message, attempt) for retries waiting out
+        # their backoff, guarded by _due
+        self._delayed = []
+        self._sequence = itertools.count()
+        self._due = threading.Condition()
+        self._stopping = False
+        # (worker threads, retry scheduler thread), started on first use
+        self._threads = ProcessLocal(self._spawn)
+        self._lock = threading.Lock()
+        self._closed = False
+        self.drain_timeout = drain_timeout
+        self.stats = {'queued': 0, 'sent': 0, 'retried': 0, 'dead': 0}
+    
+    def configure(self, transport=None, workers=None, maxsize=None, max_attempts=None, backoff=None,
+                  drain_timeout=None):
+        """Change settings before the first message is queued"""
+        if transport is not None:
+            self.transport = transport
+        if workers is not None:
+            self.workers = workers
+        if maxsize is not None:
+            self._queue = queue.Queue(maxsize)
+        if max_attempts is not None:
+            self.max_attempts = max_attempts
+        if backoff is not None:
+            self.backoff = backoff
+        if drain_timeout is not None:
+            self.drain_timeout = drain_timeout
+    
+    def start(self):
+        """Start this process's delivery threads ahead of the first message"""
+        self._threads.get()
+    
+    def send(self, message):
+        """Queue a message for delivery, returning False if it was dropped"""
+        self.start()
+        if self._closed:
+            self._dead_letter(message, 0, 'queue closed')
+            return False
+        try:
+            self._queue.put_nowait((message, 1))
+        except queue.Full:
+            self._dead_letter(message, 0, 'queue full')
+            return False
+        self._count('queued')
+        return True
+    
+    def drain(self, timeout=None):
+        """Stop accepting messages and wait for queued ones to be delivered"""
+        with self._lock:
+            self._closed = True
+        workers, scheduler = self._threads.peek() or ([], None)
+        deadline = None if timeout is None else time.monotonic() + timeout
+    
+        # Wait for every accepted message, including retries still on the
+        # delay heap, whose failed attempt is not marked done until they
+        # are back on the queue
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    logger.error('email queue drain timed out with %d messages left', self._queue.unfinished_tasks)
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+    
+        for _ in workers:
+            self._queue.put((_STOP, 0))
+        with self._due:
+            self._stopping = True
+            self._due.notify()
+        for thread in workers + ([scheduler] if scheduler else []):
+            thread.join()
+        return True
+    
+    def _spawn(self):
+        # Anything a parent process had queued is the parent's to send
+        self._queue = queue.Queue(self._queue.maxsize)
+        self._delayed = []
+        self._due = threading.Condition()
+        self._closed = False
+        self._stopping = False
+        workers = [
+            threading.Thread(target=self._work, name=f'email-{i}', daemon=True)
+            for i in range(self.workers)
+        ]
+        scheduler = threading.Thread(target=self._schedule_retries, name='email-retry', daemon=True)
+        for thread in workers + [scheduler]:
+            thread.start()
+        return workers, scheduler
+    
+    def _work(self):
+        while True:
+            message, attempt = self._queue.get()
+            if message is _STOP:
+                self._queue.task_done()
+                return
+            try:
+                self.transport.send(message)
+            except Exception as e:
+                if self._retry(message, attempt, e):
+                    # Marked done by the scheduler once the retry is queued
+                    continue
+            else:
+                self._count('sent')
+            self._queue.task_done()
+    
+    def _retry(self, message, attempt, error):
+        """Put a failed message on the delay heap, returning False if it was dead-lettered instead"""
+        if attempt >= self.max_attempts:
+            self._dead_letter(message, attempt, repr(error))
+            return False
+        logger.warning('email to %s failed (attempt %d): %r', message.get('to'), attempt, error)
+        self._count('retried')
+        not_before = time.monotonic() + self.backoff * 2 ** (attempt - 1)
+        with self._due:
+            heapq.heappush(self._delayed, (not_before, next(self._sequence), message, attempt + 1))
+            self._due.notify()
+        return True
+    
+    def _schedule_retries(self):
+        while True:
+            with self._due:
+                while True:
+                    if self._stopping:
+                        return
+                    timeout = self._delayed[0][0] - time.monotonic() if self._delayed else None
+                    if timeout is not None and timeout <= 0:
+                        break
+                    self._due.wait(timeout)
+                _, _, message, attempt = heapq.heappop(self._delayed)
+            # Retries go to the back of the queue, queued before the failed
+            # attempt is marked done so drain never sees an empty queue between
+            try:
+                self._queue.put_nowait((message, attempt))
+            except queue.Full:
+                self._dead_letter(message, attempt - 1, 'queue full')
+            self._queue.task_done()
+    
+    def _dead_letter(self, message, attempts, reason):
+        self._count('dead')
+        logger.error(json.dumps({
+            'dead_letter': True,
+            'to': message.get('to'),
+            'subject': message.get('subject'),
+            'attempts': attempts,
+            'reason': reason,
+        }))
+    
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+
+email_queue = EmailQueue()
+# Deliver what is still queued when the process shuts down
+atexit.register(lambda: email_queue.drain(timeout=email_queue.drain_timeout))
@@ -1,14 +1,88 @@
+from google.api_core import exceptions
 from google.cloud import firestore
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
+from app import app
+from app.cache import MISSING, TTLCache, identity_map
+from app.exchange import couples_to_exclusions
+from app.fanout import fan_out
+from app.instrumentation import instrument
+from app.passwords import password_hasher
+from app.storage import LazyClient, create_client
+import random
 import secrets
+import time
+import zlib
 from datetime import datetime
+from urllib.parse import quote
 
-db = firestore.Client(database='giftster-db')
+# Firestore by default; STORAGE_BACKEND can swap in a local backend. The
+# client is created on first use in each process.
+db = instrument(LazyClient(lambda: create_client(app.config)))
+
+# Firestore rejects batches with more than 500 writes
+BATCH_WRITE_LIMIT = 500
+
+# Documents fetched per get_all call when hydrating large groups
+BATCH_READ_CHUNK_SIZE = 100
+
+# Outcomes of GiftList.claim, unclaim and delete
+CLAIMED = 'claimed'
+UNCLAIMED = 'unclaimed'
+DELETED = 'deleted'
+ALREADY_CLAIMED = 'already_claimed'
+NOT_CLAIMER = 'not_claimer'
+OWN_ITEM = 'own_item'
+NOT_FOUND = 'not_found'
+CONTENDED = 'contended'
+
+# Guarded gift writes that lose a race are re-read and retried with
+# exponential backoff starting at CLAIM_BACKOFF_SECONDS
+CLAIM_MAX_ATTEMPTS = 5
+CLAIM_BACKOFF_SECONDS = 0.02
+
+# Join codes drawn before Group.create gives up; each collision costs a commit
+JOIN_CODE_MAX_ATTEMPTS = 5
+
+# Group pages read members and gifts from groups/{id}/snapshot/{shard}
+# documents, split by member so concurrent claims spread over several
+# documents. Bump the schema to make every snapshot rebuild on its next read
+# (2 added per-member versions, 3 shard byte counts and overflow).
+GROUP_SNAPSHOT_SHARDS = 4
+GROUP_SNAPSHOT_SCHEMA = 3
+
+# Most a shard may hold, as counted by _encoded_size. Writes merge into a
+# shard without reading it, so the limit is checked when the shard is read:
+# one found past it is marked overflowed, and group pages read their members
+# from the source documents instead. The margin up to Firestore's 1 MiB
+# document limit covers what can be written between two reads, about one
+# full import (IMPORT_MAX_BYTES), and drift in the running byte counts.
+GROUP_SNAPSHOT_MAX_BYTES = 448 * 1024
+
+# Lazy rebuilds that lose a race with a snapshot write are retried with the
+# same backoff as claims, up to this many attempts
+GROUP_SNAPSHOT_REBUILD_ATTEMPTS = 3
+
+# Most values Firestore accepts in one 'in' filter
+IN_QUERY_LIMIT = 30
+
+# Gift fields copied into the group snapshot
+SNAPSHOT_GIFT_FIELDS = ('item_name', 'description', 'link', 'is_claimed', 'claimer_id')
+
+# Marks a guarded write that deletes the gift
+_DELETE = object()
+
+# Users loaded by the Flask-Login user_loader, shared by every request in the
+# process. Sized from USER_CACHE_SIZE / USER_CACHE_TTL in app/__init__.py.
+user_cache = TTLCache()
+
+# group_id -> {giver_id: assignment data} for started gift exchanges, which
+# never change. Sized from EXCHANGE_CACHE_SIZE in app/__init__.py.
+exchange_cache = TTLCache(maxsize=256, ttl=24 * 60 * 60)
 
 class User(UserMixin):
-    def __init__(self, user_id, data=None):
+    def __init__(self, user_id, data=None, update_time=None):
         self.id = user_id
+        self.update_time = update_time
         if data:
             self.first_name = data.get('first_name', '')
             self.last_name = data.get('last_name', '')
@@ -18,42 +92,80 @@ class User(UserMixin):
     @staticmethod
     def get(user_id):
         """Get user by ID"""
-        doc = db.collection('users').document(user_id).get()
-        if doc.exists:
-            return User(doc.id, doc.to_dict())
-        return None
+        def load():
+            doc = db.collection('users').document(user_id).get()
+            if doc.exists:
+                return User(doc.id, doc.to_dict(), doc.update_time)
+            return None
+        return _cached(('users', user_id), load)
+    
+    @staticmethod
+    def get_cached(user_id):
+        """Get user by ID through the process-wide user cache"""
+        user = user_cache.get(user_id)
+        if user is not None:
+            _cache_put(('users', user_id), user)
+            return user
+        user = User.get(user_id)
+        if user:
+            user_cache.put(user_id, user)
+        return user
+    
+    @staticmethod
+    def get_many(user_ids):
+        """Get users by ID with batched reads, in the order given"""
+        return [user for user in _get_many('users', user_ids, User).values() if user]
     
     @staticmethod
     def get_by_email(email):
-        """Get user by email"""
+        """Get user by email through the user_emails index"""
+        index_doc = _email_index_ref(email).get()
+        if index_doc.exists:
+            return User.get(index_doc.to_dict()['user_id'])
+        
+        # Users registered before the index existed; see backfill_email_index
         users = db.collection('users').where('email', '==', email).limit(1).stream()
         for user in users:
-            return User(user.id, user.to_dict())
+            return User(user.id, user.to_dict(), user.update_time)
         return None
     
     @staticmethod
     def create(first_name, last_name, email, password):
-        """Create a new user"""
+        """Create a new user, or return None if the email is already registered"""
         user_ref = db.collection('users').document()
         user_data = {
             'first_name': first_name,
             'last_name': last_name,
             'email': email,
-            'password_hash': generate_password_hash(password)
+            'password_hash': password_hasher.hash(password)
         }
-        user_ref.set(user_data)
+        # The index document can only be created once, so of two sign-ups
+        # with the same email exactly one commits
+        batch = db.batch()
+        batch.create(_email_index_ref(email), {'user_id': user_ref.id, 'email': email})
+        batch.set(user_ref, user_data)
+        try:
+            batch.commit()
+        except exceptions.AlreadyExists:
+            return None
         return User(user_ref.id, user_data)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
+    
+    def password_needs_rehash(self):
+        """Check if the stored hash predates the configured hash parameters"""
+        return password_hasher.needs_rehash(self.password_hash)
     
     def update_password(self, new_password):
         """Update user's password"""
-        new_hash = generate_password_hash(new_password)
+        new_hash = password_hasher.hash(new_password)
         db.collection('users').document(self.id).update({
             'password_hash': new_hash
         })
         self.password_hash = new_hash
+        _cache_put(('users', self.id), self)
+        user_cache.evict(self.id)
     
     @property
     def full_name(self):
@@ -61,8 +173,11 @@ class User(UserMixin):
 
 
 class Group:
-    def __init__(self, group_id, data=None):
+    def __init__(self, group_id, data=None, update_time=None):
         self.id = group_id
+        # Changes with the group document only; member and gift writes
+        # change the snapshot shards' instead (GroupSnapshot.get_update_times)
+        self.update_time = update_time
         if data:
             self.name = data.get('name', '')
             self.description = data.get('description', '')
@@ -70,110 +185,244 @@ class Group:
             self.created_by = data.get('created_by', '')
             self.created_at = data.get('created_at')
             self.has_gift_exchange = data.get('has_gift_exchange', False)
+            # Bumped by every start, so cached assignments from an earlier
+            # round are never served after a reset
+            self.exchange_round = data.get('exchange_round', 0)
+            # Pairs of members who never draw each other
+            self.exchange_couples = [tuple(couple['member_ids']) for couple in data.get('exchange_couples', [])]
+            # (giver_id, receiver_id) pairs drawn in the last round, recorded
+            # by reset_gift_exchange
+            self.exchange_previous = [
+                (pair['giver_id'], pair['receiver_id'])
+                for pair in data.get('exchange_previous', [])
+            ]
     
     @staticmethod
     def get(group_id):
         """Get group by ID"""
-        doc = db.collection('groups').document(group_id).get()
-        if doc.exists:
-            return Group(doc.id, doc.to_dict())
-        return None
+        def load():
+            doc = db.collection('groups').document(group_id).get()
+            if doc.exists:
+                return Group(doc.id, doc.to_dict(), doc.update_time)
+            return None
+        return _cached(('groups', group_id), load)
+    
+    @staticmethod
+    def get_many(group_ids):
+        """Get groups by ID with batched reads, in the order given"""
+        return [group for group in _get_many('groups', group_ids, Group).values() if group]
     
     @staticmethod
     def get_by_join_code(join_code):
-        """Get group by join code"""
+        """Get group by join code through its join_codes reservation"""
+        reservation = db.collection('join_codes').document(join_code).get()
+        if reservation.exists:
+            return Group.get(reservation.to_dict()['group_id'])
+        
+        # Groups created before reservations existed; see backfill_join_codes
         groups = db.collection('groups').where('join_code', '==', join_code).limit(1).stream()
         for group in groups:
-            return Group(group.id, group.to_dict())
+            return Group(group.id, group.to_dict(), group.update_time)
         return None
     
     @staticmethod
     def create(name, description, created_by):
         """Create a new group"""
         group_ref = db.collection('groups').document()
-        join_code = Group.generate_join_code()
-        group_data = {
-            'name': name,
-            'description': description,
-            'join_code': join_code,
-            'created_by': created_by,
-            'created_at': firestore.SERVER_TIMESTAMP,
-            'has_gift_exchange': False
-        }
-        group_ref.set(group_data)
-        
-        # Add creator as member
-        group_ref.collection('members').document(created_by).set({
-            'joined_at': firestore.SERVER_TIMESTAMP
-        })
-        
-        return Group(group_ref.id, group_data)
+        for attempt in range(JOIN_CODE_MAX_ATTEMPTS):
+            join_code = Group.generate_join_code()
+            group_data = {
+                'name': name,
+                'description': description,
+                'join_code': join_code,
+                'created_by': created_by,
+                'created_at': firestore.SERVER_TIMESTAMP,
+                'has_gift_exchange': False
+            }
+            # Reserve the code in the same commit as the group; a code that
+            # is already taken fails the whole commit and we draw another
+            batch = db.batch()
+            batch.create(db.collection('join_codes').document(join_code), {'group_id': group_ref.id})
+            batch.set(group_ref, group_data)
+            
+            # Add creator as member
+            _set_membership(batch, group_ref.id, created_by)
+            creator = User.get(created_by)
+            members = {created_by: _snapshot_member(creator)} if creator else {}
+            _set_snapshot(batch, group_ref.id, members)
+            try:
+                batch.commit()
+            except exceptions.AlreadyExists:
+                continue
+            return Group(group_ref.id, group_data)
+        raise RuntimeError(f'No free join code after {JOIN_CODE_MAX_ATTEMPTS} attempts; increase JOIN_CODE_LENGTH')
     
     @staticmethod
     def generate_join_code():
-        """Generate a unique 6-character join code"""
-        while True:
-            code = secrets.token_urlsafe(6)[:6].upper()
-            # Check if code exists
-            existing = db.collection('groups').where('join_code', '==', code).limit(1).get()
-            if not list(existing):
-                return code
+        """Generate a random join code from JOIN_CODE_ALPHABET"""
+        alphabet = app.config['JOIN_CODE_ALPHABET']
+        return ''.join(secrets.choice(alphabet) for _ in range(app.config['JOIN_CODE_LENGTH']))
     
     def add_member(self, user_id):
         """Add a member to the group"""
-        db.collection('groups').document(self.id).collection('members').document(user_id).set({
-            'joined_at': firestore.SERVER_TIMESTAMP
-        })
+        batch = db.batch()
+        _set_membership(batch, self.id, user_id)
+        user = User.get(user_id)
+        if user:
+            member = _snapshot_member(user)
+            _update_snapshot(batch, self.id, user_id, member, _encoded_size({user_id: member}))
+        batch.commit()
+        _cache_put(('groups', self.id, 'members', user_id), True)
     
     def is_member(self, user_id):
         """Check if user is a member"""
-        doc = db.collection('groups').document(self.id).collection('members').document(user_id).get()
-        return doc.exists
+        def load():
+            doc = db.collection('groups').document(self.id).collection('members').document(user_id).get()
+            return doc.exists
+        return _cached(('groups', self.id, 'members', user_id), load)
     
-    def get_members(self):
-        """Get all members of the group"""
+    def get_member_ids(self):
+        """Get the user IDs of all members of the group"""
         members_docs = db.collection('groups').document(self.id).collection('members').stream()
         member_ids = [doc.id for doc in members_docs]
-        members = []
         for user_id in member_ids:
-            user = User.get(user_id)
-            if user:
-                members.append(user)
-        return members
+            _cache_put(('groups', self.id, 'members', user_id), True)
+        return member_ids
+    
+    @staticmethod
+    def get_member_ids_many(groups):
+        """Get {group_id: member IDs} for several groups, querying them concurrently"""
+        member_ids = fan_out.map(lambda group: group.get_member_ids(), groups)
+        return {group.id: ids for group, ids in zip(groups, member_ids)}
+    
+    def get_members(self):
+        """Get all members of the group"""
+        return User.get_many(self.get_member_ids())
+    
+    def get_member_ids_page(self, limit, after=None):
+        """Get up to limit member IDs in ID order, starting after the member ID after"""
+        query = db.collection('groups').document(self.id).collection('members').order_by('__name__')
+        if after:
+            query = query.start_after({'__name__': after})
+        member_ids = [doc.id for doc in query.limit(limit).stream()]
+        for user_id in member_ids:
+            _cache_put(('groups', self.id, 'members', user_id), True)
+        return member_ids
+    
+    def count_members(self):
+        """Count members with an aggregation query instead of reading them"""
+        result = db.collection('groups').document(self.id).collection('members').count().get()
+        return result[0][0].value
+    
+    def exchange_exclusions(self, avoid_previous=True):
+        """(giver_id, receiver_id) pairs the next draw must not make: couples, and optionally last round's pairings"""
+        exclusions = list(couples_to_exclusions(self.exchange_couples))
+        if avoid_previous:
+            exclusions.extend(self.exchange_previous)
+        return exclusions
+    
+    def add_exchange_couple(self, member_id, partner_id):
+        """Record two members who should never draw each other"""
+        couple = tuple(sorted((member_id, partner_id)))
+        db.collection('groups').document(self.id).update({
+            'exchange_couples': firestore.ArrayUnion([{'member_ids': list(couple)}])
+        })
+        if couple not in self.exchange_couples:
+            self.exchange_couples.append(couple)
+    
+    def remove_exchange_couple(self, member_id, partner_id):
+        """Forget a couple recorded by add_exchange_couple"""
+        couple = tuple(sorted((member_id, partner_id)))
+        db.collection('groups').document(self.id).update({
+            'exchange_couples': firestore.ArrayRemove([{'member_ids': list(couple)}])
+        })
+        self.exchange_couples = [c for c in self.exchange_couples if c != couple]
     
     def start_gift_exchange(self, assignments):
         """Start gift exchange with assignments list of (giver_id, receiver_id) tuples"""
-        batch = db.batch()
+        assignments = list(assignments)
+        receivers = {user.id: user for user in User.get_many([receiver_id for _, receiver_id in assignments])}
+        
+        # Large groups need more than one batch, so the group is only marked
+        # as having an exchange in the last commit, after every assignment
+        batch = _ChunkedBatch()
         
-        # Add all assignments
+        # Add all assignments, keyed by giver
         for giver_id, receiver_id in assignments:
-            exchange_ref = db.collection('groups').document(self.id).collection('gift_exchanges').document()
-            batch.set(exchange_ref, {
-                'giver_id': giver_id,
-                'receiver_id': receiver_id,
-                'created_at': firestore.SERVER_TIMESTAMP
-            })
+            exchange_ref = db.collection('groups').document(self.id).collection('gift_exchanges').document(giver_id)
+            batch.set(exchange_ref, _exchange_data(giver_id, receiver_id, receivers.get(receiver_id)))
         
         # Mark group as having gift exchange
         group_ref = db.collection('groups').document(self.id)
-        batch.update(group_ref, {'has_gift_exchange': True})
+        batch.update(group_ref, {'has_gift_exchange': True, 'exchange_round': firestore.Increment(1)})
         
         batch.commit()
         self.has_gift_exchange = True
+        self.exchange_round += 1
+    
+    def reset_gift_exchange(self):
+        """End the current exchange, keeping its pairings so the next draw can avoid them"""
+        group_ref = db.collection('groups').document(self.id)
+        docs = list(group_ref.collection('gift_exchanges').stream())
+        previous = [(doc.to_dict()['giver_id'], doc.to_dict()['receiver_id']) for doc in docs]
+        
+        # The group is marked first, so a reset cut short by a failed commit
+        # leaves old assignments that the next start overwrites, never an
+        # active exchange with some of them missing
+        batch = _ChunkedBatch()
+        batch.update(group_ref, {
+            'has_gift_exchange': False,
+            'exchange_previous': [{'giver_id': giver_id, 'receiver_id': receiver_id} for giver_id, receiver_id in previous]
+        })
+        for doc in docs:
+            batch.delete(doc.reference)
+        batch.commit()
+        self.has_gift_exchange = False
+        self.exchange_previous = previous
+        return len(previous)
     
     def get_gift_exchange_assignment(self, giver_id):
-        """Get the receiver for a giver"""
-        assignments = db.collection('groups').document(self.id).collection('gift_exchanges').where('giver_id', '==', giver_id).limit(1).stream()
-        for assignment in assignments:
-            data = assignment.to_dict()
-            return User.get(data['receiver_id'])
+        """Get the receiver for a giver
+        
+        Assignments never change once an exchange starts, so they are kept in
+        a process-wide per-group map after the first point read.
+        """
+        cache_key = (self.id, self.exchange_round)
+        assignment_map = exchange_cache.get(cache_key)
+        if assignment_map is None:
+            assignment_map = {}
+            exchange_cache.put(cache_key, assignment_map)
+        if giver_id not in assignment_map:
+            assignment_map[giver_id] = self._load_gift_exchange_assignment(giver_id)
+        
+        data = assignment_map[giver_id]
+        if data is None:
+            return None
+        return User(data['receiver_id'], {
+            'first_name': data.get('receiver_first_name', ''),
+            'last_name': data.get('receiver_last_name', '')
+        })
+    
+    def _load_gift_exchange_assignment(self, giver_id):
+        exchanges = db.collection('groups').document(self.id).collection('gift_exchanges')
+        doc = exchanges.document(giver_id).get()
+        if doc.exists:
+            return doc.to_dict()
+        
+        # Exchanges started before assignments were keyed by giver; see
+        # migrate_gift_exchanges
+        for assignment in exchanges.where('giver_id', '==', giver_id).limit(1).stream():
+            receiver_id = assignment.to_dict()['receiver_id']
+            return _exchange_data(giver_id, receiver_id, User.get(receiver_id))
         return None
 
 
 class GiftList:
-    def __init__(self, gift_id, group_id, data=None):
+    def __init__(self, gift_id, group_id, data=None, update_time=None):
         self.id = gift_id
         self.group_id = group_id
+        # Version read from the datastore, used to guard claim writes
+        self.update_time = update_time
         if data:
             self.user_id = data.get('user_id', '')
             self.item_name = data.get('item_name', '')
@@ -194,57 +443,719 @@ class GiftList:
             'is_claimed': False,
             'claimer_id': None
         }
-        gift_ref.set(gift_data)
-        return GiftList(gift_ref.id, group_id, gift_data)
+        batch = db.batch()
+        batch.set(gift_ref, gift_data)
+        gifts = {gift_ref.id: _snapshot_gift(gift_data)}
+        _update_snapshot(batch, group_id, user_id, {'gifts': gifts}, _encoded_size(gifts))
+        results = batch.commit()
+        return GiftList(gift_ref.id, group_id, gift_data, results[0].update_time)
+    
+    @staticmethod
+    def create_many(group_id, user_id, items):
+        """Create gift items from (item_name, description, link) tuples in as few commits as fit
+        
+        Each commit holds up to BATCH_WRITE_LIMIT - 1 items plus one snapshot
+        merge, so it is atomic on its own, but
+        a failure part way through keeps the chunks already committed.
+        """
+        gift_lists = db.collection('groups').document(group_id).collection('gift_lists')
+        items = list(items)
+        chunk_size = BATCH_WRITE_LIMIT - 1
+        gifts = []
+        for start in range(0, len(items), chunk_size):
+            batch = db.batch()
+            chunk = []
+            for item_name, description, link in items[start:start + chunk_size]:
+                gift_ref = gift_lists.document()
+                gift_data = {
+                    'user_id': user_id,
+                    'item_name': item_name,
+                    'description': description,
+                    'link': link,
+                    'is_claimed': False,
+                    'claimer_id': None
+                }
+                batch.set(gift_ref, gift_data)
+                chunk.append((gift_ref.id, gift_data))
+            summaries = {gift_id: _snapshot_gift(gift_data) for gift_id, gift_data in chunk}
+            _update_snapshot(batch, group_id, user_id, {'gifts': summaries}, _encoded_size(summaries))
+            results = batch.commit()
+            gifts.extend(GiftList(gift_id, group_id, gift_data, result.update_time)
+                         for (gift_id, gift_data), result in zip(chunk, results))
+        return gifts
+    
+    @staticmethod
+    def copy_to_group(source_group_id, target_group_id, user_id):
+        """Copy a user's items into another group, unclaimed, returning (copied, skipped)
+        
+        Items the user already has in the target group, by name and link,
+        are skipped, so copying twice does not duplicate anything.
+        """
+        existing = {(gift.item_name, gift.link) for gift in GiftList.get_by_user(target_group_id, user_id)}
+        items = []
+        skipped = 0
+        for gift in GiftList.get_by_user(source_group_id, user_id):
+            if (gift.item_name, gift.link) in existing:
+                skipped += 1
+                continue
+            existing.add((gift.item_name, gift.link))
+            items.append((gift.item_name, gift.description, gift.link))
+        return len(GiftList.create_many(target_group_id, user_id, items)), skipped
     
     @staticmethod
     def get(group_id, gift_id):
         """Get a specific gift item"""
-        doc = db.collection('groups').document(group_id).collection('gift_lists').document(gift_id).get()
-        if doc.exists:
-            return GiftList(doc.id, group_id, doc.to_dict())
-        return None
+        def load():
+            doc = db.collection('groups').document(group_id).collection('gift_lists').document(gift_id).get()
+            if doc.exists:
+                return GiftList(doc.id, group_id, doc.to_dict(), doc.update_time)
+            return None
+        return _cached(('groups', group_id, 'gift_lists', gift_id), load)
     
     @staticmethod
     def get_by_user(group_id, user_id):
         """Get all gifts for a user in a group"""
         gifts_docs = db.collection('groups').document(group_id).collection('gift_lists').where('user_id', '==', user_id).stream()
-        return [GiftList(doc.id, group_id, doc.to_dict()) for doc in gifts_docs]
+        return [GiftList(doc.id, group_id, doc.to_dict(), doc.update_time) for doc in gifts_docs]
     
     @staticmethod
     def get_all_in_group(group_id):
         """Get all gifts in a group"""
-        gifts_docs = db.collection('groups').document(group_id).collection('gift_lists').stream()
-        return [GiftList(doc.id, group_id, doc.to_dict()) for doc in gifts_docs]
+        return list(GiftList.stream_in_group(group_id))
+    
+    @staticmethod
+    def stream_in_group(group_id, user_id=None):
+        """Yield a group's gifts, or one user's, as the query returns them"""
+        query = db.collection('groups').document(group_id).collection('gift_lists')
+        if user_id:
+            query = query.where('user_id', '==', user_id)
+        for doc in query.stream():
+            yield GiftList(doc.id, group_id, doc.to_dict(), doc.update_time)
+    
+    @staticmethod
+    def get_claimed_by(claimer_id, limit, after=None):
+        """Get one page of a user's claimed gifts across every group, and the cursor for the next page
+        
+        One collection-group query over gift_lists, ordered by document path
+        so each group's gifts come together. ``after`` is a cursor returned
+        by an earlier call. Needs the collection-group claimer_id index in
+        firestore.indexes.json.
+        """
+        query = db.collection_group('gift_lists').where('claimer_id', '==', claimer_id).order_by('__name__')
+        if after:
+            group_id, gift_id = after.split('/', 1)
+            # A reference, since a bare ID would resolve against the collection group
+            gift_ref = db.collection('groups').document(group_id).collection('gift_lists').document(gift_id)
+            query = query.start_after({'__name__': gift_ref})
+        docs = list(query.limit(limit + 1).stream())
+        gifts = [GiftList(doc.id, doc.reference.parent.parent.id, doc.to_dict(), doc.update_time) for doc in docs[:limit]]
+        next_cursor = f'{gifts[-1].group_id}/{gifts[-1].id}' if len(docs) > limit else None
+        return gifts, next_cursor
     
     def update(self, **kwargs):
         """Update gift item fields"""
-        db.collection('groups').document(self.group_id).collection('gift_lists').document(self.id).update(kwargs)
+        batch = db.batch()
+        batch.update(db.collection('groups').document(self.group_id).collection('gift_lists').document(self.id), kwargs)
+        # Only the changed fields: the rest of the entry may have been claimed
+        # or unclaimed since this gift was read
+        changes = _snapshot_gift(kwargs)
+        if changes:
+            grow = _encoded_size(changes) - _encoded_size({key: getattr(self, key) for key in changes})
+            _update_snapshot(batch, self.group_id, self.user_id, {'gifts': {self.id: changes}}, grow)
+        results = batch.commit()
         for key, value in kwargs.items():
             setattr(self, key, value)
+        self.update_time = results[0].update_time
+        _cache_put(('groups', self.group_id, 'gift_lists', self.id), self)
     
     def delete(self):
-        """Delete gift item"""
-        db.collection('groups').document(self.group_id).collection('gift_lists').document(self.id).delete()
+        """Delete gift item, releasing its claim from the claimer's counters"""
+        def plan(gift):
+            return DELETED, _DELETE, gift._release_claim()
+        return self._commit_guarded(plan)
     
     def claim(self, claimer_id):
-        """Claim this gift"""
-        self.update(is_claimed=True, claimer_id=claimer_id)
+        """Claim this gift unless its owner or someone else got there first"""
+        def plan(gift):
+            if gift.user_id == claimer_id:
+                return OWN_ITEM, None, []
+            if gift.is_claimed:
+                return (CLAIMED if gift.claimer_id == claimer_id else ALREADY_CLAIMED), None, []
+            return CLAIMED, {'is_claimed': True, 'claimer_id': claimer_id}, [(claimer_id, 1)]
+        return self._commit_guarded(plan)
+    
+    def unclaim(self, claimer_id):
+        """Release this gift if claimer_id is the one who claimed it"""
+        def plan(gift):
+            if not gift.is_claimed or gift.claimer_id != claimer_id:
+                return NOT_CLAIMER, None, []
+            return UNCLAIMED, {'is_claimed': False, 'claimer_id': None}, gift._release_claim()
+        return self._commit_guarded(plan)
+    
+    def _summary(self, **changes):
+        """The gift's group snapshot entry after applying changes"""
+        fields = {key: getattr(self, key) for key in SNAPSHOT_GIFT_FIELDS}
+        fields.update(_snapshot_gift(changes))
+        return fields
     
-    def unclaim(self):
-        """Unclaim this gift"""
-        self.update(is_claimed=False, claimer_id=None)
+    def _release_claim(self):
+        if self.is_claimed and self.claimer_id:
+            return [(self.claimer_id, -1)]
+        return []
+    
+    def _commit_guarded(self, plan):
+        """Apply plan(gift) as one write conditioned on the gift being unchanged
+        
+        plan returns (result, fields, counter deltas); fields is None when
+        there is nothing to write and _DELETE to delete the gift. The gift
+        write and the claim counter updates commit atomically, and only if
+        the gift's update_time still matches the version the plan saw. If
+        another writer got there first, the gift is re-read and the plan
+        re-evaluated, with exponential backoff, up to CLAIM_MAX_ATTEMPTS.
+        """
+        gift_ref = db.collection('groups').document(self.group_id).collection('gift_lists').document(self.id)
+        cache_key = ('groups', self.group_id, 'gift_lists', self.id)
+        for attempt in range(CLAIM_MAX_ATTEMPTS):
+            if attempt:
+                time.sleep(CLAIM_BACKOFF_SECONDS * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+            if attempt or self.update_time is None:
+                doc = gift_ref.get()
+                if not doc.exists:
+                    _cache_put(cache_key, None)
+                    return NOT_FOUND
+                self.__init__(doc.id, self.group_id, doc.to_dict(), doc.update_time)
+            
+            result, fields, deltas = plan(self)
+            if fields is None:
+                return result
+            
+            batch = db.batch()
+            option = db.write_option(last_update_time=self.update_time)
+            entry_size = _encoded_size({self.id: self._summary()})
+            if fields is _DELETE:
+                batch.delete(gift_ref, option=option)
+                _update_snapshot(batch, self.group_id, self.user_id, {'gifts': {self.id: firestore.DELETE_FIELD}}, -entry_size)
+            else:
+                batch.update(gift_ref, fields, option=option)
+                summary = {self.id: self._summary(**fields)}
+                _update_snapshot(batch, self.group_id, self.user_id, {'gifts': summary}, _encoded_size(summary) - entry_size)
+            for claimer_id, delta in deltas:
+                _count_claim(batch, self.group_id, claimer_id, self.user_id, delta)
+            try:
+                write_results = batch.commit()
+            except (exceptions.Aborted, exceptions.FailedPrecondition, exceptions.NotFound):
+                continue
+            
+            if fields is _DELETE:
+                _cache_put(cache_key, None)
+            else:
+                for key, value in fields.items():
+                    setattr(self, key, value)
+                self.update_time = write_results[0].update_time
+                _cache_put(cache_key, self)
+            return result
+        return CONTENDED
+
+
+class GroupSnapshot:
+    """Members and their gifts for one group, read from its snapshot shards"""
+    
+    def __init__(self, group_id, members, update_times=None, overflowed=False):
+        self.group_id = group_id
+        # user_id -> {'first_name', 'last_name', 'version', 'gifts': {gift_id: fields}}
+        self.members = members
+        # The shards' update times in shard order, or None if not read from them
+        self.update_times = update_times
+        # Set when a shard is too big to store. members is then empty, and
+        # pages read the members they show with from_source.
+        self.overflowed = overflowed
+    
+    @staticmethod
+    def get(group_id):
+        """Read every shard in one batched read, rebuilding the snapshot if any is missing or stale
+        
+        Shards found past GROUP_SNAPSHOT_MAX_BYTES are marked overflowed. If
+        any shard is, the snapshot comes back empty with overflowed set.
+        """
+        def load():
+            docs = _get_snapshot_shards(group_id)
+            if any(not doc.exists or doc.to_dict().get('schema') != GROUP_SNAPSHOT_SCHEMA for doc in docs):
+                return GroupSnapshot.rebuild(group_id)
+            update_times = tuple(doc.update_time for doc in docs)
+            oversized = [doc for doc in docs if _shard_oversized(doc.to_dict())]
+            if oversized:
+                _mark_overflowed(oversized)
+            if oversized or any(doc.to_dict().get('overflow') for doc in docs):
+                return GroupSnapshot(group_id, {}, update_times, overflowed=True)
+            members = {}
+            for doc in docs:
+                members.update(doc.to_dict().get('members', {}))
+            return GroupSnapshot(group_id, members, update_times)
+        return _cached(('groups', group_id, 'snapshot'), load)
+    
+    @staticmethod
+    def get_update_times(group_id):
+        """The shards' update times in shard order, reading no members
+        
+        Every snapshot write changes one, so they stand for the state of the
+        group's members and gifts.
+        """
+        return tuple(doc.update_time for doc in _get_snapshot_shards(group_id, field_paths=['schema']))
+    
+    @staticmethod
+    def from_source(group_id, member_ids=None, versions=False):
+        """Read members and gifts from the members, users and gift_lists collections
+        
+        With member_ids, only those members and their gifts are read, with
+        one gift query per IN_QUERY_LIMIT members issued concurrently.
+        """
+        group_ref = db.collection('groups').document(group_id)
+        if member_ids is None:
+            member_ids = [doc.id for doc in group_ref.collection('members').stream()]
+            gift_docs = group_ref.collection('gift_lists').stream()
+        else:
+            chunks = [member_ids[start:start + IN_QUERY_LIMIT] for start in range(0, len(member_ids), IN_QUERY_LIMIT)]
+            gift_docs = [doc for docs in fan_out.map(
+                lambda chunk: list(group_ref.collection('gift_lists').where('user_id', 'in', chunk).stream()), chunks
+            ) for doc in docs]
+        members = {user.id: _snapshot_member(user) for user in User.get_many(member_ids)}
+        if not versions:
+            # Nothing bumps these, so fragments must not be cached under them
+            for member in members.values():
+                member['version'] = None
+        for gift_doc in gift_docs:
+            gift = gift_doc.to_dict()
+            if gift.get('user_id') in members:
+                members[gift['user_id']].setdefault('gifts', {})[gift_doc.id] = _snapshot_gift(gift)
+        return GroupSnapshot(group_id, members)
+    
+    @staticmethod
+    def rebuild(group_id):
+        """Rewrite the snapshot from the source documents
+        
+        The shards are read before the source documents and rewritten only
+        if none has changed since, so a write that lands in between makes
+        the rebuild start over instead of being lost. If it still loses
+        after GROUP_SNAPSHOT_REBUILD_ATTEMPTS, what was read is returned
+        without being stored. Shards too big to store are written as
+        overflowed.
+        """
+        for attempt in range(GROUP_SNAPSHOT_REBUILD_ATTEMPTS):
+            if attempt:
+                time.sleep(CLAIM_BACKOFF_SECONDS * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+            docs = _get_snapshot_shards(group_id, field_paths=['schema'])
+            snapshot = GroupSnapshot.from_source(group_id, versions=True)
+            batch = db.batch()
+            _set_snapshot(batch, group_id, snapshot.members, docs)
+            try:
+                results = batch.commit()
+            except (exceptions.AlreadyExists, exceptions.FailedPrecondition, exceptions.NotFound):
+                continue
+            snapshot.update_times = tuple(result.update_time for result in results)
+            _cache_put(('groups', group_id, 'snapshot'), snapshot)
+            return snapshot
+        
+        # Versions that were never stored must not key cached fragments either
+        for member in snapshot.members.values():
+            member['version'] = None
+        return snapshot
+    
+    def is_member(self, user_id):
+        return user_id in self.members
+    
+    def member_ids(self):
+        """Member IDs in ID order, the same order as the members subcollection"""
+        return sorted(self.members)
+    
+    def user(self, user_id):
+        member = self.members[user_id]
+        return User(user_id, {'first_name': member.get('first_name', ''), 'last_name': member.get('last_name', '')})
+    
+    def member_version(self, user_id):
+        """Stamp that changes whenever the member's names or gifts do"""
+        return self.members[user_id].get('version')
+    
+    def gifts(self, user_id):
+        """The member's gifts as GiftList objects, without update times"""
+        gifts = self.members.get(user_id, {}).get('gifts', {})
+        return [GiftList(gift_id, self.group_id, dict(fields, user_id=user_id)) for gift_id, fields in gifts.items()]
+
+
+class _ChunkedBatch:
+    """Write batch that commits every BATCH_WRITE_LIMIT writes"""
+    
+    def __init__(self):
+        self._batch = db.batch()
+        self._pending = 0
+        self.written = 0
+    
+    def set(self, reference, document_data, merge=False):
+        self._batch.set(reference, document_data, merge=merge)
+        self._added()
+    
+    def update(self, reference, field_updates):
+        self._batch.update(reference, field_updates)
+        self._added()
+    
+    def delete(self, reference):
+        self._batch.delete(reference)
+        self._added()
+    
+    def _added(self):
+        self._pending += 1
+        self.written += 1
+        if self._pending == BATCH_WRITE_LIMIT:
+            self.commit()
+    
+    def commit(self):
+        if self._pending:
+            self._batch.commit()
+            self._batch = db.batch()
+            self._pending = 0
+
+
+def _cached(key, load):
+    """Read through the request's identity map so each document is fetched once"""
+    cache = identity_map()
+    if cache is None:
+        return load()
+    return cache.load(key, load)
+
+
+def _cache_put(key, value):
+    """Write a model through to the request's identity map"""
+    cache = identity_map()
+    if cache is not None:
+        cache.put(key, value)
+
+
+def _get_many(collection, doc_ids, model):
+    """Load models by ID in BATCH_READ_CHUNK_SIZE get_all calls, keyed by ID in the order given
+    
+    Documents that do not exist map to None. Models already in the request's
+    identity map are reused instead of being fetched again.
+    """
+    cache = identity_map()
+    models = {doc_id: MISSING for doc_id in doc_ids}
+    if cache is not None:
+        for doc_id in models:
+            models[doc_id] = cache.get((collection, doc_id))
+    
+    refs = [db.collection(collection).document(doc_id) for doc_id, value in models.items() if value is MISSING]
+    for docs in _get_all_chunked(refs):
+        for doc in docs:
+            models[doc.id] = model(doc.id, doc.to_dict(), doc.update_time) if doc.exists else None
+            _cache_put((collection, doc.id), models[doc.id])
+    
+    for doc_id, value in models.items():
+        if value is MISSING:
+            models[doc_id] = None
+    return models
+
+
+def _get_all_chunked(refs):
+    """Read documents in BATCH_READ_CHUNK_SIZE get_all calls issued concurrently, one list per chunk"""
+    chunks = [refs[start:start + BATCH_READ_CHUNK_SIZE] for start in range(0, len(refs), BATCH_READ_CHUNK_SIZE)]
+    return fan_out.map(lambda chunk: list(db.get_all(chunk)), chunks)
+
+
+def _exchange_data(giver_id, receiver_id, receiver):
+    """Assignment document with the receiver's display name copied in"""
+    return {
+        'giver_id': giver_id,
+        'receiver_id': receiver_id,
+        'receiver_first_name': receiver.first_name if receiver else '',
+        'receiver_last_name': receiver.last_name if receiver else '',
+        'created_at': firestore.SERVER_TIMESTAMP
+    }
+
+
+def normalize_email(email):
+    """Key used for email uniqueness: trimmed and lowercased"""
+    return email.strip().lower()
+
+
+def _email_index_ref(email):
+    # Document IDs cannot contain '/', so the key is percent-encoded
+    return db.collection('user_emails').document(quote(normalize_email(email), safe='@+'))
+
+
+def _snapshot_ref(group_id, shard):
+    return db.collection('groups').document(group_id).collection('snapshot').document(str(shard))
+
+
+def _snapshot_shard(user_id):
+    # crc32 rather than hash(), which changes between processes
+    return zlib.crc32(user_id.encode()) % GROUP_SNAPSHOT_SHARDS
+
+
+def _snapshot_data(members):
+    size = _encoded_size(members)
+    if size > GROUP_SNAPSHOT_MAX_BYTES:
+        return _overflow_data()
+    return {
+        'schema': GROUP_SNAPSHOT_SCHEMA,
+        'version': 0,
+        'rebuilt_at': firestore.SERVER_TIMESTAMP,
+        'bytes': size,
+        'overflow': False,
+        'members': members
+    }
+
+
+def _overflow_data():
+    # A shard too big to store. Its members are dropped, and group pages read
+    # the source documents until a rebuild finds that it fits again.
+    return {
+        'schema': GROUP_SNAPSHOT_SCHEMA,
+        'version': 0,
+        'rebuilt_at': firestore.SERVER_TIMESTAMP,
+        'bytes': 0,
+        'overflow': True,
+        'members': {}
+    }
+
+
+def _get_snapshot_shards(group_id, field_paths=None):
+    """Read a group's snapshot shards in one batched read, in shard order"""
+    refs = [_snapshot_ref(group_id, shard) for shard in range(GROUP_SNAPSHOT_SHARDS)]
+    # get_all returns documents in no particular order
+    return sorted(db.get_all(refs, field_paths=field_paths), key=lambda doc: int(doc.id))
+
+
+def _shard_oversized(data):
+    return not data.get('overflow') and data.get('bytes', 0) > GROUP_SNAPSHOT_MAX_BYTES
+
+
+def _mark_overflowed(docs):
+    """Mark shards that grew past GROUP_SNAPSHOT_MAX_BYTES as overflowed, unless they changed since they were read"""
+    batch = db.batch()
+    for doc in docs:
+        batch.update(doc.reference, _overflow_data(), option=db.write_option(last_update_time=doc.update_time))
+    try:
+        batch.commit()
+    except exceptions.FailedPrecondition:
+        # Written since; the next read checks them again
+        pass
+
+
+def _set_snapshot(batch, group_id, members, current=None):
+    """Overwrite every shard of a group's snapshot with the given members
+    
+    current is the shards as read before members were, if they were. Each
+    shard is then only written if it is still missing or unchanged.
+    """
+    shards = [{} for _ in range(GROUP_SNAPSHOT_SHARDS)]
+    for user_id, member in members.items():
+        shards[_snapshot_shard(user_id)][user_id] = member
+    for shard, shard_members in enumerate(shards):
+        ref = _snapshot_ref(group_id, shard)
+        data = _snapshot_data(shard_members)
+        if current is None:
+            batch.set(ref, data)
+        elif not current[shard].exists:
+            batch.create(ref, data)
+        else:
+            # update() replaces each top-level field it is given, members included
+            batch.update(ref, data, option=db.write_option(last_update_time=current[shard].update_time))
+
+
+def _snapshot_member(user):
+    # Versions start at random, so a member rebuilt or re-added never
+    # reuses a version that fragments were cached under before
+    return {'first_name': user.first_name, 'last_name': user.last_name, 'version': random.getrandbits(48)}
+
+
+def _snapshot_gift(fields):
+    return {key: fields[key] for key in SNAPSHOT_GIFT_FIELDS if key in fields}
+
+
+def _update_snapshot(batch, group_id, user_id, member_fields, grow):
+    """Merge one member's changed fields into their snapshot shard, bumping the shard's and member's versions
+    
+    grow is the change in the shard's encoded size. The shard is not read:
+    GroupSnapshot.get checks its byte count against GROUP_SNAPSHOT_MAX_BYTES.
+    A merge into a missing shard leaves it without a schema, so it is
+    rebuilt on the next read.
+    """
+    # Merges into an overflowed shard are harmless: its members are never read
+    batch.set(_snapshot_ref(group_id, _snapshot_shard(user_id)), {
+        'version': firestore.Increment(1),
+        'bytes': firestore.Increment(grow),
+        'members': {user_id: {'version': firestore.Increment(1), **member_fields}}
+    }, merge=True)
+
+
+def _encoded_size(value):
+    """Approximate Firestore storage size of a value, by its documented rules"""
+    if isinstance(value, dict):
+        return sum(len(key.encode()) + 1 + _encoded_size(item) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(_encoded_size(item) for item in value)
+    if isinstance(value, str):
+        return len(value.encode()) + 1
+    if value is None or isinstance(value, bool):
+        return 1
+    return 8
+
+
+def _set_membership(batch, group_id, user_id, joined_at=firestore.SERVER_TIMESTAMP):
+    """Write a membership to both the group's members and the user's group index"""
+    batch.set(db.collection('groups').document(group_id).collection('members').document(user_id), {
+        'joined_at': joined_at
+    })
+    batch.set(db.collection('users').document(user_id).collection('groups').document(group_id), {
+        'joined_at': joined_at
+    })
+
+
+def _count_claim(batch, group_id, claimer_id, recipient_id, delta):
+    """Adjust the claimer's per-recipient claim counter in the same batch"""
+    counts_ref = db.collection('groups').document(group_id).collection('claim_counts').document(claimer_id)
+    batch.set(counts_ref, {'counts': {recipient_id: firestore.Increment(delta)}}, merge=True)
+
+
+def get_claim_counts(claimer_id, group_ids):
+    """Get {group_id: {recipient_id: gifts claimed}} for a claimer with batched reads"""
+    refs = [db.collection('groups').document(group_id).collection('claim_counts').document(claimer_id)
+            for group_id in dict.fromkeys(group_ids)]
+    claim_counts = {group_id: {} for group_id in group_ids}
+    for docs in _get_all_chunked(refs):
+        for doc in docs:
+            if doc.exists:
+                claim_counts[doc.reference.parent.parent.id] = doc.to_dict().get('counts', {})
+    return claim_counts
 
 
 def get_user_groups(user_id):
     """Get all groups a user is a member of"""
-    # Query all groups where user is in members subcollection
-    all_groups = db.collection('groups').stream()
-    user_groups = []
+    # users/{user_id}/groups mirrors groups/{group_id}/members, so one query
+    # finds the group IDs and one batched read loads them
+    index_docs = db.collection('users').document(user_id).collection('groups').stream()
+    return Group.get_many([doc.id for doc in index_docs])
+
+
+def backfill_membership_index():
+    """Rebuild users/{user_id}/groups from every group's members subcollection"""
+    batch = _ChunkedBatch()
+    for group_doc in db.collection('groups').stream():
+        for member_doc in group_doc.reference.collection('members').stream():
+            joined_at = member_doc.to_dict().get('joined_at') or firestore.SERVER_TIMESTAMP
+            index_ref = db.collection('users').document(member_doc.id).collection('groups').document(group_doc.id)
+            batch.set(index_ref, {'joined_at': joined_at})
+    batch.commit()
+    return batch.written
+
+
+def backfill_email_index():
+    """Build user_emails from every user, returning (written, duplicate emails)"""
+    users_by_email = {}
+    for user_doc in db.collection('users').stream():
+        email = user_doc.to_dict().get('email')
+        if email:
+            users_by_email.setdefault(normalize_email(email), []).append(user_doc)
     
-    for group_doc in all_groups:
-        member_doc = group_doc.reference.collection('members').document(user_id).get()
-        if member_doc.exists:
-            user_groups.append(Group(group_doc.id, group_doc.to_dict()))
+    written = 0
+    duplicates = []
+    emails = list(users_by_email)
+    for start in range(0, len(emails), BATCH_READ_CHUNK_SIZE):
+        chunk = emails[start:start + BATCH_READ_CHUNK_SIZE]
+        indexed = {doc.id for doc in db.get_all([_email_index_ref(email) for email in chunk]) if doc.exists}
+        batch = db.batch()
+        for email in chunk:
+            user_docs = users_by_email[email]
+            if len(user_docs) > 1:
+                duplicates.append(email)
+            if _email_index_ref(email).id in indexed:
+                continue
+            # With duplicates one account keeps the email; the rest are
+            # reported so they can be merged by hand
+            user_doc = user_docs[0]
+            batch.create(_email_index_ref(email), {'user_id': user_doc.id, 'email': user_doc.to_dict()['email']})
+            written += 1
+        batch.commit()
+    return written, duplicates
+
+
+def backfill_join_codes():
+    """Reserve join_codes for every group, returning (written, duplicate codes)"""
+    groups_by_code = {}
+    for group_doc in db.collection('groups').select(['join_code']).stream():
+        code = group_doc.to_dict().get('join_code')
+        if code:
+            groups_by_code.setdefault(code, []).append(group_doc.id)
     
-    return user_groups
\ No newline at end of file
+    written = 0
+    duplicates = []
+    codes = list(groups_by_code)
+    for start in range(0, len(codes), BATCH_READ_CHUNK_SIZE):
+        chunk = codes[start:start + BATCH_READ_CHUNK_SIZE]
+        reserved = {doc.id for doc in db.get_all([db.collection('join_codes').document(code) for code in chunk]) if doc.exists}
+        batch = db.batch()
+        for code in chunk:
+            group_ids = groups_by_code[code]
+            if len(group_ids) > 1:
+                duplicates.append(code)
+            if code in reserved:
+                continue
+            # With duplicates one group keeps the code; the others need new
+            # codes before anyone can join them by code
+            batch.create(db.collection('join_codes').document(code), {'group_id': group_ids[0]})
+            written += 1
+        batch.commit()
+    return written, duplicates
+
+
+def rebuild_group_snapshots(group_ids=None):
+    """Rebuild the snapshot shards of the given groups, or of every group"""
+    if group_ids is None:
+        group_ids = [doc.id for doc in db.collection('groups').select([]).stream()]
+    for group_id in group_ids:
+        GroupSnapshot.rebuild(group_id)
+    return len(group_ids)
+
+
+def recount_claims(group_ids=None):
+    """Rebuild groups/{group_id}/claim_counts from the gift_lists subcollections"""
+    if group_ids is None:
+        group_ids = [doc.id for doc in db.collection('groups').stream()]
+    batch = _ChunkedBatch()
+    for group_id in group_ids:
+        group_ref = db.collection('groups').document(group_id)
+        counts = {}
+        for gift_doc in group_ref.collection('gift_lists').where('is_claimed', '==', True).stream():
+            gift = gift_doc.to_dict()
+            if gift.get('claimer_id'):
+                claimer_counts = counts.setdefault(gift['claimer_id'], {})
+                claimer_counts[gift.get('user_id', '')] = claimer_counts.get(gift.get('user_id', ''), 0) + 1
+        
+        # Overwrite every counter document so stale claimers are reset too
+        for counts_doc in group_ref.collection('claim_counts').stream():
+            if counts_doc.id not in counts:
+                batch.delete(counts_doc.reference)
+        for claimer_id, claimer_counts in counts.items():
+            batch.set(group_ref.collection('claim_counts').document(claimer_id), {'counts': claimer_counts})
+    batch.commit()
+    return len(group_ids)
+
+
+def migrate_gift_exchanges():
+    """Re-key gift_exchanges documents by giver and copy in receiver names"""
+    batch = _ChunkedBatch()
+    migrated = 0
+    for group_doc in db.collection('groups').where('has_gift_exchange', '==', True).stream():
+        legacy = [doc for doc in group_doc.reference.collection('gift_exchanges').stream()
+                  if doc.id != doc.to_dict().get('giver_id')]
+        if not legacy:
+            continue
+        receivers = {user.id: user for user in User.get_many([doc.to_dict()['receiver_id'] for doc in legacy])}
+        for doc in legacy:
+            data = doc.to_dict()
+            keyed = _exchange_data(data['giver_id'], data['receiver_id'], receivers.get(data['receiver_id']))
+            keyed['created_at'] = data.get('created_at') or firestore.SERVER_TIMESTAMP
+            batch.set(group_doc.reference.collection('gift_exchanges').document(data['giver_id']), keyed)
+            batch.delete(doc.reference)
+            migrated += 1
+    batch.commit()
+    exchange_cache.clear()
+    return migrated
\ No newline at end of file
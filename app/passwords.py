@@ -0,0 +1,157 @@
+"""Password hashing off the request path.
+
+Werkzeug's default scrypt hash takes tens of milliseconds of CPU and 32 MB
+of memory per call. PasswordHasher runs hashes on a small thread pool and
+admits at most PASSWORD_HASH_MAX_PENDING at a time (running or waiting);
+beyond that it raises HashingBusy straight away instead of queueing, so a
+burst of logins cannot pin the CPU for every other route.
+
+LoginThrottle counts login attempts per client IP and failures per email
+address in a sliding window. Routes check it before any hashing happens.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from werkzeug.security import generate_password_hash, check_password_hash
+from app.process_local import ProcessLocal
+
+# Werkzeug's defaults when a method is given without parameters
+SCRYPT_DEFAULTS = ('32768', '8', '1')
+PBKDF2_DEFAULTS = ('sha256', '600000')
+
+
+class HashingBusy(Exception):
+    """Raised when too many password hashes are already running or waiting"""
+
+
+def normalize_method(method):
+    """Spell out a Werkzeug hash method with its default parameters"""
+    name, *args = method.split(':')
+    if name == 'scrypt':
+        args = args or list(SCRYPT_DEFAULTS)
+    elif name == 'pbkdf2':
+        args = args + list(PBKDF2_DEFAULTS[len(args):])
+    else:
+        raise ValueError(f'Unsupported password hash method: {method!r}')
+    return ':'.join([name] + args)
+
+
+class PasswordHasher:
+    def __init__(self, method='scrypt', workers=1, max_pending=8, timeout=5.0):
+        self._executor = ProcessLocal(lambda: ThreadPoolExecutor(self.workers, thread_name_prefix='password-hash'))
+        self._lock = threading.Lock()
+        self.rejected = 0
+        self.configure(method, workers, max_pending, timeout)
+    
+    def configure(self, method=None, workers=None, max_pending=None, timeout=None):
+        """Change settings before the first hash"""
+        if method is not None:
+            self.method = normalize_method(method)
+        if workers is not None:
+            self.workers = workers
+        if max_pending is not None:
+            self.max_pending = max_pending
+            self._slots = threading.BoundedSemaphore(max_pending)
+        if timeout is not None:
+            self.timeout = timeout
+    
+    def start(self):
+        """Start this process's hashing pool ahead of the first hash"""
+        self._executor.get()
+    
+    def hash(self, password):
+        """Hash a password with the configured method"""
+        return self._run(generate_password_hash, password, self.method)
+    
+    def verify(self, password_hash, password):
+        """Check a password against a stored hash"""
+        if not password_hash:
+            return False
+        return self._run(check_password_hash, password_hash, password)
+    
+    def needs_rehash(self, password_hash):
+        """True if a stored hash was made with other parameters than the configured ones"""
+        return password_hash.split('$', 1)[0] != self.method
+    
+    def _run(self, fn, *args):
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            self._reject()
+        try:
+            future = self._executor.get().submit(fn, *args)
+        except BaseException:
+            slots.release()
+            raise
+        # The slot stays taken until the hash finishes, even if the request
+        # stops waiting for it
+        future.add_done_callback(lambda _: slots.release())
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            self._reject()
+    
+    def _reject(self):
+        with self._lock:
+            self.rejected += 1
+        raise HashingBusy()
+
+
+class LoginThrottle:
+    def __init__(self, limit, window, maxkeys=10000, clock=time.monotonic):
+        self.limit = limit
+        self.window = window
+        self.maxkeys = maxkeys
+        self.clock = clock
+        self._attempts = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def configure(self, limit=None, window=None):
+        """Change the limit or window"""
+        if limit is not None:
+            self.limit = limit
+        if window is not None:
+            self.window = window
+    
+    def retry_after(self, key):
+        """Seconds until key may try again, or 0 if it is under the limit"""
+        if not key or not self.limit:
+            return 0
+        with self._lock:
+            attempts = self._prune(key)
+            if attempts is None or len(attempts) < self.limit:
+                return 0
+            return max(1, int(attempts[0] + self.window - self.clock()) + 1)
+    
+    def hit(self, key):
+        """Record an attempt for key"""
+        if not key or not self.limit:
+            return
+        with self._lock:
+            attempts = self._prune(key)
+            if attempts is None:
+                attempts = self._attempts[key] = deque()
+                # Forget the least recently seen key past maxkeys
+                if len(self._attempts) > self.maxkeys:
+                    self._attempts.popitem(last=False)
+            self._attempts.move_to_end(key)
+            attempts.append(self.clock())
+    
+    def reset(self, key):
+        """Forget attempts for key"""
+        with self._lock:
+            self._attempts.pop(key, None)
+    
+    def _prune(self, key):
+        attempts = self._attempts.get(key)
+        if attempts is None:
+            return None
+        cutoff = self.clock() - self.window
+        while attempts and attempts[0] <= cutoff:
+            attempts.popleft()
+        return attempts
+
+
+password_hasher = PasswordHasher()
+ip_throttle = LoginThrottle(limit=30, window=300)
+email_throttle = LoginThrottle(limit=5, window=300)
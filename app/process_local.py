@@ -0,0 +1,37 @@
+"""Values built lazily, once per process.
+
+gunicorn preloads the app and then forks its workers. Threads and gRPC
+channels do not survive a fork, so thread pools, email workers and the
+datastore client are built on first use in each process, never inherited
+from the parent.
+"""
+import os
+import threading
+
+
+class ProcessLocal:
+    """Holds the value factory() returned in the current process, building it on first use"""
+    
+    def __init__(self, factory):
+        self._factory = factory
+        self._value = None
+        self._pid = None
+        self._lock = threading.Lock()
+    
+    @property
+    def initialized(self):
+        """True once the value has been built in this process"""
+        return self._pid == os.getpid()
+    
+    def get(self):
+        """The value for this process, built on the first call in each process"""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._value = self._factory()
+                    self._pid = os.getpid()
+        return self._value
+    
+    def peek(self):
+        """The value built in this process, or None if there is none yet"""
+        return self._value if self.initialized else None
@@ -1,13 +1,41 @@
-from flask import render_template, redirect, url_for, request, flash
+from flask import render_template, stream_template, stream_with_context, redirect, url_for, request, flash, g, get_flashed_messages, abort
 from flask_login import login_user, logout_user, login_required, current_user
 from app import app, login_manager
-from app.models import User, Group, GiftList, get_user_groups
+from app.models import User, Group, GiftList, GroupSnapshot, get_user_groups, get_claim_counts, normalize_email, user_cache
+from app.models import ALREADY_CLAIMED, CONTENDED, NOT_CLAIMER, NOT_FOUND, OWN_ITEM
+from app.bulk import InvalidImport, export_rows, parse_items, stream_csv, stream_json
+from app.exchange import ExchangeInfeasible, assign_gift_exchange
+from app.fanout import fan_out
+from app.fragments import fragment_cache, gift_table_html
+from app.passwords import HashingBusy, email_throttle, ip_throttle
 from app.utils import send_reset_email, get_serializer
-import random
+from werkzeug.utils import secure_filename
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.get(user_id)
+    return User.get_cached(user_id)
+
+@app.after_request
+def report_cache_stats(response):
+    cache = g.get('identity_map')
+    if cache is not None:
+        app.logger.debug('identity map for %s: %d hits, %d misses', request.path, cache.hits, cache.misses)
+        if app.debug:
+            response.headers['X-Identity-Map'] = f'hits={cache.hits}; misses={cache.misses}'
+    if app.debug:
+        stats = user_cache.stats()
+        response.headers['X-User-Cache'] = f"size={stats['size']}; hit_rate={stats['hit_rate']:.3f}"
+        stats = fragment_cache.stats()
+        response.headers['X-Fragment-Cache'] = f"size={stats['size']}; bytes={stats['bytes']}; hit_rate={stats['hit_rate']:.3f}"
+    return response
+
+@app.errorhandler(HashingBusy)
+def hashing_busy(error):
+    # Password hashing is saturated; shed the request rather than queue it
+    flash('We are handling a lot of sign-ins right now. Please try again in a moment.', 'danger')
+    response = redirect(request.url)
+    response.headers['Retry-After'] = '5'
+    return response
 
 @app.route('/')
 def index():
@@ -27,11 +55,11 @@ def register():
         email = request.form['email']
         password = request.form['password']
         
-        # Check if email already exists
-        if User.get_by_email(email):
+        # Check if email already exists. The lookup saves hashing a password
+        # for nothing; create still fails if a concurrent sign-up wins.
+        if User.get_by_email(email) or User.create(first_name, last_name, email, password) is None:
             flash('Email is already registered', 'danger')
         else:
-            User.create(first_name, last_name, email, password)
             flash('Registration successful! Please log in.', 'success')
             return redirect(url_for('login'))
     
@@ -45,12 +73,31 @@ def login():
     if request.method == 'POST':
         email = request.form['email']
         password = request.form['password']
+        
+        # Throttle before any lookup or hashing happens. Failures are counted
+        # per account, under the same key the email index uses.
+        email_key = normalize_email(email)
+        retry_after = max(ip_throttle.retry_after(request.remote_addr), email_throttle.retry_after(email_key))
+        if retry_after:
+            flash('Too many login attempts. Please try again later.', 'danger')
+            return render_template('login.html'), 429, {'Retry-After': str(retry_after)}
+        ip_throttle.hit(request.remote_addr)
+        
         user = User.get_by_email(email)
         
         if user and user.check_password(password):
+            email_throttle.reset(email_key)
+            # Upgrade hashes made with older parameters while we have the
+            # password; if hashing is saturated, it happens at a later login
+            if user.password_needs_rehash():
+                try:
+                    user.update_password(password)
+                except HashingBusy:
+                    pass
             login_user(user)
             return redirect(url_for('dashboard'))
         else:
+            email_throttle.hit(email_key)
             flash('Invalid email or password', 'danger')
     
     return render_template('login.html')
@@ -80,7 +127,7 @@ def forgot_password():
             # Create reset URL
             reset_url = url_for('reset_password', token=token, _external=True)
             
-            # Send email (for now just prints to console)
+            # Queue the email; background workers send it after we respond
             send_reset_email(email, reset_url)
             
         # Always show success message (don't reveal if email exists)
@@ -133,25 +180,24 @@ def dashboard():
     # Get all groups the user is a member of
     user_groups = get_user_groups(current_user.id)
     
+    # Per-recipient claim counters for every group, read in one batch
+    claim_counts = get_claim_counts(current_user.id, [group.id for group in user_groups])
+    
+    # Only member IDs are needed here, so skip loading the user documents
+    member_ids_by_group = Group.get_member_ids_many(user_groups)
+    
     groups_data = []
     for group in user_groups:
-        # Get all members of this group
-        members = group.get_members()
+        member_ids = member_ids_by_group[group.id]
         
         # Count how many people the current user still needs to buy for
-        needs_gift = 0
-        for member in members:
-            if member.id != current_user.id:
-                # Get gifts for this member in this group
-                member_gifts = GiftList.get_by_user(group.id, member.id)
-                # Check if current user has claimed any
-                claimed_by_me = sum(1 for g in member_gifts if g.claimer_id == current_user.id)
-                if claimed_by_me == 0:
-                    needs_gift += 1
+        counts = claim_counts[group.id]
+        needs_gift = sum(1 for member_id in member_ids
+                         if member_id != current_user.id and counts.get(member_id, 0) <= 0)
         
         groups_data.append({
             'group': group,
-            'member_count': len(members),
+            'member_count': len(member_ids),
             'needs_gift_count': needs_gift
         })
     
@@ -199,40 +245,78 @@ def group_detail(group_id):
         flash('Group not found', 'danger')
         return redirect(url_for('dashboard'))
     
+    # Membership, the snapshot shards and the gift exchange assignment only
+    # depend on the group, so read them concurrently
+    is_member, snapshot, gift_exchange_assignment = fan_out.run([
+        lambda: group.is_member(current_user.id),
+        # Members' names and gifts, from one batched read of the shards
+        lambda: GroupSnapshot.get(group.id),
+        lambda: group.get_gift_exchange_assignment(current_user.id) if group.has_gift_exchange else None,
+    ])
+    
     # Check if user is a member
-    if not group.is_member(current_user.id):
+    if not is_member:
         flash('You are not a member of this group', 'danger')
         return redirect(url_for('dashboard'))
     
     # Check if user is the creator
     is_creator = (group.created_by == current_user.id)
     
-    # Get all members
-    members = group.get_members()
+    # One page of members in ID order, after the cursor if there is one
+    page_size = app.config['GROUP_PAGE_SIZE']
+    after = request.args.get('after')
+    partial = snapshot.overflowed
+    if partial:
+        # Too big for the snapshot, so read just this page's members and
+        # gifts from the source documents
+        member_ids = group.get_member_ids_page(page_size + 1, after)
+        snapshot, member_count = fan_out.run([
+            lambda: GroupSnapshot.from_source(group.id, member_ids[:page_size]),
+            group.count_members,
+        ])
+    else:
+        member_ids = [member_id for member_id in snapshot.member_ids() if not after or member_id > after]
+        member_count = len(snapshot.members)
+    next_cursor = member_ids[page_size - 1] if len(member_ids) > page_size else None
+    member_ids = [member_id for member_id in member_ids[:page_size] if snapshot.is_member(member_id)]
+    
+    # The session cookie is sent with the headers, so pop flashed messages
+    # now rather than while the body streams
+    get_flashed_messages()
+    
+    # Names for the creator's exchange setup, from the snapshot already read
+    # unless it only holds this page
+    exchange_members = None
+    if is_creator and not group.has_gift_exchange:
+        if partial:
+            exchange_members = [(user.id, user.full_name) for user in group.get_members()]
+        else:
+            exchange_members = [(member_id, snapshot.user(member_id).full_name) for member_id in snapshot.member_ids()]
     
-    # Check if gift exchange is active and get assignment
-    gift_exchange_assignment = None
-    if group.has_gift_exchange:
-        gift_exchange_assignment = group.get_gift_exchange_assignment(current_user.id)
-    
-    # Get all members and their gifts (excluding current user)
-    member_gifts = []
-    for member in members:
-        if member.id != current_user.id:
-            gifts = GiftList.get_by_user(group.id, member.id)
-            claimed_by_me = sum(1 for g in gifts if g.claimer_id == current_user.id)
-            member_gifts.append({
-                'user': member,
-                'gifts': gifts,
-                'claimed_by_me': claimed_by_me
-            })
-    
-    return render_template('group_detail.html', 
-                         group=group, 
-                         member_gifts=member_gifts,
+    # Render and send a member at a time rather than buffering the page
+    return stream_template('group_detail.html',
+                         group=group,
+                         member_gifts=_member_gifts(snapshot, [m for m in member_ids if m != current_user.id]),
                          is_creator=is_creator,
-                         member_count=len(members),
-                         gift_exchange_assignment=gift_exchange_assignment)
+                         member_count=member_count,
+                         gift_exchange_assignment=gift_exchange_assignment,
+                         exchange_members=exchange_members,
+                         after=after,
+                         next_cursor=next_cursor)
+
+def _member_gifts(snapshot, member_ids):
+    """Yield each member with their gift table from the group snapshot"""
+    for member_id in member_ids:
+        gifts = snapshot.gifts(member_id)
+        claimed_by_me = sum(1 for gift in gifts if gift.claimer_id == current_user.id)
+        # Rendered once per version of the member's list, then reused for
+        # every viewer
+        gifts_html = gift_table_html(snapshot.group_id, member_id, snapshot.member_version(member_id), gifts, current_user.id)
+        yield {
+            'user': snapshot.user(member_id),
+            'gifts_html': gifts_html,
+            'claimed_by_me': claimed_by_me
+        }
 
 @app.route('/group/<group_id>/start-gift-exchange', methods=['POST'])
 @login_required
@@ -252,39 +336,77 @@ def start_gift_exchange(group_id):
         flash('Gift exchange has already been started for this group', 'info')
         return redirect(url_for('group_detail', group_id=group_id))
     
-    # Get all members
-    members = group.get_members()
+    # Get all member IDs
+    member_ids = group.get_member_ids()
     
     # Need at least 2 people for gift exchange
-    if len(members) < 2:
+    if len(member_ids) < 2:
         flash('You need at least 2 members to start a gift exchange', 'danger')
         return redirect(url_for('group_detail', group_id=group_id))
     
-    # Create random assignments (ensure no one gets themselves)
-    givers = [m.id for m in members]
-    receivers = givers.copy()
-    
-    # Shuffle until no one has themselves
-    valid = False
-    attempts = 0
-    while not valid and attempts < 100:
-        random.shuffle(receivers)
-        valid = all(givers[i] != receivers[i] for i in range(len(givers)))
-        attempts += 1
-    
-    if not valid:
-        flash('Unable to create gift exchange assignments. Please try again.', 'danger')
+    # Create random assignments (no one gets themselves, their partner or,
+    # unless the creator opts out, last round's match)
+    exclusions = group.exchange_exclusions(avoid_previous=request.form.get('avoid_previous') == '1')
+    try:
+        assignments = assign_gift_exchange(member_ids, exclusions)
+    except ExchangeInfeasible:
+        flash('No gift exchange assignment satisfies this group\'s exclusions.', 'danger')
         return redirect(url_for('group_detail', group_id=group_id))
     
-    # Create assignments list
-    assignments = [(givers[i], receivers[i]) for i in range(len(givers))]
-    
     # Save to Firestore
     group.start_gift_exchange(assignments)
     
     flash('Gift exchange started! Check who you got below.', 'success')
     return redirect(url_for('group_detail', group_id=group_id))
 
+@app.route('/group/<group_id>/reset-gift-exchange', methods=['POST'])
+@login_required
+def reset_gift_exchange(group_id):
+    group = Group.get(group_id)
+    if not group:
+        flash('Group not found', 'danger')
+        return redirect(url_for('dashboard'))
+    
+    if group.created_by != current_user.id:
+        flash('Only the group creator can reset the gift exchange', 'danger')
+        return redirect(url_for('group_detail', group_id=group_id))
+    
+    if not group.has_gift_exchange:
+        flash('No gift exchange has been started for this group', 'info')
+        return redirect(url_for('group_detail', group_id=group_id))
+    
+    # The finished round's pairings are kept so the next draw can avoid them
+    group.reset_gift_exchange()
+    flash('Gift exchange reset. The next draw will avoid this round\'s matches.', 'success')
+    return redirect(url_for('group_detail', group_id=group_id))
+
+@app.route('/group/<group_id>/exchange-couples', methods=['POST'])
+@login_required
+def exchange_couples(group_id):
+    """Add or remove a couple who should never draw each other"""
+    group = Group.get(group_id)
+    if not group:
+        flash('Group not found', 'danger')
+        return redirect(url_for('dashboard'))
+    
+    if group.created_by != current_user.id:
+        flash('Only the group creator can manage couples', 'danger')
+        return redirect(url_for('group_detail', group_id=group_id))
+    
+    member_id = request.form.get('member_id', '')
+    partner_id = request.form.get('partner_id', '')
+    if request.form.get('action') == 'remove':
+        group.remove_exchange_couple(member_id, partner_id)
+        flash('Couple removed.', 'info')
+    elif not member_id or member_id == partner_id:
+        flash('Pick two different members.', 'danger')
+    elif not (group.is_member(member_id) and group.is_member(partner_id)):
+        flash('Both people must be members of this group.', 'danger')
+    else:
+        group.add_exchange_couple(member_id, partner_id)
+        flash('Couple saved. They will never draw each other.', 'success')
+    return redirect(url_for('group_detail', group_id=group_id))
+
 @app.route('/my-list/<group_id>', methods=['GET', 'POST'])
 @login_required
 def my_list(group_id):
@@ -306,8 +428,104 @@ def my_list(group_id):
         GiftList.create(group_id, current_user.id, item_name, description, link)
         return redirect(url_for('my_list', group_id=group_id))
     
-    gifts = GiftList.get_by_user(group_id, current_user.id)
-    return render_template('my_list.html', gifts=gifts, group=group)
+    gifts, user_groups = fan_out.run([
+        lambda: GiftList.get_by_user(group_id, current_user.id),
+        lambda: get_user_groups(current_user.id),
+    ])
+    # Groups this list can be copied to
+    other_groups = [other for other in user_groups if other.id != group_id]
+    return render_template('my_list.html', gifts=gifts, group=group, other_groups=other_groups)
+
+@app.route('/my-list/<group_id>/import', methods=['POST'])
+@login_required
+def import_items(group_id):
+    group = Group.get(group_id)
+    if not group or not group.is_member(current_user.id):
+        flash('You are not a member of this group', 'danger')
+        return redirect(url_for('dashboard'))
+    
+    # An uploaded file wins over pasted text
+    max_bytes = app.config['IMPORT_MAX_BYTES']
+    upload = request.files.get('file')
+    if upload and upload.filename:
+        data = upload.read(max_bytes + 1)
+        filename = upload.filename
+    else:
+        data = request.form.get('items', '').encode('utf-8')
+        filename = ''
+    if len(data) > max_bytes:
+        flash(f'Imports are limited to {max_bytes // 1024} KB.', 'danger')
+        return redirect(url_for('my_list', group_id=group_id))
+    
+    try:
+        items = parse_items(data.decode('utf-8'), filename, app.config['IMPORT_MAX_ITEMS'])
+    except UnicodeDecodeError:
+        flash('Imports must be UTF-8 text.', 'danger')
+        return redirect(url_for('my_list', group_id=group_id))
+    except InvalidImport as e:
+        # Nothing was written; show the first few problems
+        for error in e.errors[:5]:
+            flash(error, 'danger')
+        if len(e.errors) > 5:
+            flash(f'...and {len(e.errors) - 5} more problems. Nothing was imported.', 'danger')
+        return redirect(url_for('my_list', group_id=group_id))
+    
+    gifts = GiftList.create_many(group_id, current_user.id, items)
+    flash(f'Imported {len(gifts)} items.', 'success')
+    return redirect(url_for('my_list', group_id=group_id))
+
+@app.route('/my-list/<group_id>/copy', methods=['POST'])
+@login_required
+def copy_list(group_id):
+    target_group_id = request.form.get('target_group_id', '')
+    groups = Group.get_many([group_id, target_group_id]) if target_group_id and target_group_id != group_id else []
+    if len(groups) != 2 or not all(group.is_member(current_user.id) for group in groups):
+        flash('You can only copy your list between groups you belong to.', 'danger')
+        return redirect(url_for('my_list', group_id=group_id) if groups else url_for('dashboard'))
+    
+    copied, skipped = GiftList.copy_to_group(group_id, target_group_id, current_user.id)
+    message = f'Copied {copied} items to {groups[1].name}.'
+    if skipped:
+        message += f' Skipped {skipped} already on that list.'
+    flash(message, 'success')
+    return redirect(url_for('my_list', group_id=target_group_id))
+
+@app.route('/group/<group_id>/export')
+@login_required
+def export_group(group_id):
+    group = Group.get(group_id)
+    if not group or not group.is_member(current_user.id):
+        flash('You are not a member of this group', 'danger')
+        return redirect(url_for('dashboard'))
+    
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'json'):
+        abort(400)
+    # Only the viewer's own list with ?mine=1, ready to import elsewhere
+    user_id = current_user.id if request.args.get('mine') else None
+    snapshot = GroupSnapshot.get(group.id)
+    if snapshot.overflowed:
+        owners = {user.id: user for user in group.get_members()}
+    else:
+        owners = {member_id: snapshot.user(member_id) for member_id in snapshot.members}
+    
+    def owner_name(user_id):
+        user = owners.get(user_id)
+        if not user:
+            return ''
+        return f'{user.first_name} {user.last_name}'.strip()
+    
+    # Rows are written as the query returns them, never held all at once
+    rows = export_rows(GiftList.stream_in_group(group.id, user_id), owner_name, current_user.id)
+    if export_format == 'csv':
+        body, mimetype = stream_csv(rows), 'text/csv'
+    else:
+        body, mimetype = stream_json(rows), 'application/json'
+    filename = secure_filename(f'{group.name or "group"}-gifts.{export_format}') or f'gifts.{export_format}'
+    return app.response_class(stream_with_context(body), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'Cache-Control': 'private, no-store',
+    })
 
 @app.route('/delete-item/<group_id>/<gift_id>', methods=['POST'])
 @login_required
@@ -321,8 +539,10 @@ def delete_item(group_id, gift_id):
         flash('You are not authorized to delete this item.', 'danger')
         return redirect(url_for('dashboard'))
     
-    gift.delete()
-    flash('Gift item deleted successfully.', 'success')
+    if gift.delete() == CONTENDED:
+        flash('This item was just updated. Please try again.', 'danger')
+    else:
+        flash('Gift item deleted successfully.', 'success')
     return redirect(url_for('my_list', group_id=group_id))
 
 @app.route('/claim-item/<group_id>/<gift_id>', methods=['POST'])
@@ -333,16 +553,20 @@ def claim_item(group_id, gift_id):
         flash('Gift item not found', 'danger')
         return redirect(url_for('dashboard'))
     
-    if gift.user_id == current_user.id:
+    # Ownership and claim state are checked again inside the guarded write,
+    # so two people clicking Claim at once cannot both win
+    result = gift.claim(current_user.id)
+    if result == NOT_FOUND:
+        flash('Gift item not found', 'danger')
+        return redirect(url_for('dashboard'))
+    elif result == OWN_ITEM:
         flash('You cannot claim your own item.', 'danger')
-        return redirect(url_for('group_detail', group_id=group_id))
-    
-    if gift.is_claimed:
+    elif result == ALREADY_CLAIMED:
         flash('This item has already been claimed.', 'danger')
-        return redirect(url_for('group_detail', group_id=group_id))
-    
-    gift.claim(current_user.id)
-    flash('Gift item claimed successfully!', 'success')
+    elif result == CONTENDED:
+        flash('This item is being claimed by someone else right now. Please try again.', 'danger')
+    else:
+        flash('Gift item claimed successfully!', 'success')
     return redirect(url_for('group_detail', group_id=group_id))
 
 @app.route('/unclaim-item/<group_id>/<gift_id>', methods=['POST'])
@@ -353,10 +577,48 @@ def unclaim_item(group_id, gift_id):
         flash('Gift item not found', 'danger')
         return redirect(url_for('dashboard'))
     
-    if gift.claimer_id != current_user.id:
+    result = gift.unclaim(current_user.id)
+    if result == NOT_FOUND:
+        flash('Gift item not found', 'danger')
+        return redirect(url_for('dashboard'))
+    elif result == NOT_CLAIMER:
         flash('You did not claim this item.', 'danger')
-        return redirect(url_for('group_detail', group_id=group_id))
-    
-    gift.unclaim()
-    flash('Gift item unclaimed successfully!', 'success')
-    return redirect(url_for('group_detail', group_id=group_id))
\ No newline at end of file
+    elif result == CONTENDED:
+        flash('This item is being updated by someone else right now. Please try again.', 'danger')
+    else:
+        flash('Gift item unclaimed successfully!', 'success')
+    # The My Claims page sends people back to it
+    if request.form.get('next') == 'my_claims':
+        return redirect(url_for('my_claims'))
+    return redirect(url_for('group_detail', group_id=group_id))
+
+@app.route('/my-claims')
+@login_required
+def my_claims():
+    # One collection-group query for the page of claims, however many
+    # groups they span
+    after = request.args.get('after')
+    if after and '/' not in after:
+        after = None
+    gifts, next_cursor = GiftList.get_claimed_by(current_user.id, app.config['CLAIMS_PAGE_SIZE'], after)
+    
+    # Then one batched read each for their groups and recipients, at once
+    groups, recipients = fan_out.run([
+        lambda: Group.get_many(list(dict.fromkeys(gift.group_id for gift in gifts))),
+        lambda: User.get_many(list(dict.fromkeys(gift.user_id for gift in gifts))),
+    ])
+    groups = {group.id: group for group in groups}
+    recipients = {user.id: user for user in recipients}
+    
+    # Gifts come ordered by path, so each group's are already together
+    sections = []
+    for gift in gifts:
+        group = groups.get(gift.group_id)
+        if group is None:
+            continue
+        if not sections or sections[-1]['group'].id != group.id:
+            sections.append({'group': group, 'recipients': {}})
+        recipient = sections[-1]['recipients'].setdefault(gift.user_id, {'user': recipients.get(gift.user_id), 'gifts': []})
+        recipient['gifts'].append(gift)
+    
+    return render_template('my_claims.html', sections=sections, after=after, next_cursor=next_cursor)
\ No newline at end of file
@@ -0,0 +1,66 @@
+"""Cold start support.
+
+Nothing slow happens at import: the datastore client is created on first
+use (see app.storage.LazyClient) and the resend package is imported on the
+first send. ``warm_up()`` does that first-use work ahead of traffic. It
+opens the datastore connection with one point read, imports the email
+transport, and starts the fan-out, password hashing and email worker
+threads. gunicorn.conf.py runs it in each worker before the worker accepts
+requests, and GET /warmup runs it for startup probes. The wall time of each
+step is kept in ``startup_report``, next to how long ``import app`` took.
+"""
+import os
+import time
+from flask import jsonify
+from app import app
+from app.fanout import fan_out
+from app.mail import ResendTransport, email_queue
+from app import models
+from app.passwords import password_hasher
+
+# import_ms is set at the end of app/__init__.py, steps by warm_up()
+startup_report = {'pid': None, 'import_ms': None, 'steps': {}}
+
+
+def _prime_datastore():
+    # Any point read opens the channel; the document need not exist
+    models.db.collection('warmup').document('ping').get()
+
+
+def _prime_mail():
+    if isinstance(email_queue.transport, ResendTransport):
+        import resend
+    email_queue.start()
+
+
+WARMUP_STEPS = (
+    ('datastore', _prime_datastore),
+    ('mail', _prime_mail),
+    ('fan_out', fan_out.start),
+    ('password_hash', password_hasher.start),
+)
+
+
+def warm_up():
+    """Run every warmup step once per process, returning the startup report"""
+    if startup_report['pid'] == os.getpid():
+        return startup_report
+    steps = {}
+    for name, step in WARMUP_STEPS:
+        started = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            # A failed step is retried by its first real use, so report it
+            # rather than keep the worker from starting
+            app.logger.warning('warmup step %s failed: %r', name, e)
+            steps[name] = {'ms': round((time.perf_counter() - started) * 1000, 3), 'error': repr(e)}
+        else:
+            steps[name] = {'ms': round((time.perf_counter() - started) * 1000, 3)}
+    startup_report.update(pid=os.getpid(), steps=steps)
+    return startup_report
+
+
+@app.route('/warmup')
+def warmup():
+    return jsonify(warm_up())
@@ -0,0 +1,81 @@
+// Live claim updates for the group page, fed by /group/<id>/events
+(function () {
+    var root = document.getElementById('group-live');
+    if (!root || !window.EventSource) {
+        return;
+    }
+
+    var notice = document.getElementById('live-notice');
+
+    function showNotice() {
+        notice.hidden = false;
+    }
+
+    function button(url, label, className) {
+        var form = document.createElement('form');
+        form.method = 'POST';
+        form.action = url;
+        form.style.display = 'inline';
+        var submit = document.createElement('button');
+        submit.type = 'submit';
+        submit.className = 'btn-small ' + className;
+        submit.textContent = label;
+        form.appendChild(submit);
+        return form;
+    }
+
+    function badge(label, className) {
+        var span = document.createElement('span');
+        span.className = className;
+        span.textContent = label;
+        return span;
+    }
+
+    function update(row, gift) {
+        var status = row.querySelector('.gift-status');
+        var action = row.querySelector('.gift-action');
+        status.replaceChildren();
+        action.replaceChildren();
+        if (gift.claimed_by_me) {
+            status.appendChild(badge('Claimed by you', 'badge-success'));
+            action.appendChild(button(root.dataset.unclaimUrl.replace('GIFT_ID', gift.id), 'Unclaim', 'btn-unclaim'));
+        } else if (gift.claimed) {
+            status.appendChild(badge('Claimed', 'badge-claimed'));
+        } else {
+            status.appendChild(badge('Available', 'badge-available'));
+            action.appendChild(button(root.dataset.claimUrl.replace('GIFT_ID', gift.id), 'Claim', 'btn-claim'));
+        }
+    }
+
+    function connect() {
+        var source = new EventSource(root.dataset.eventsUrl);
+
+        source.addEventListener('gift', function (event) {
+            var message = JSON.parse(event.data);
+            var row = root.querySelector('tr[data-gift-id="' + message.gift.id + '"]');
+            if (message.change === 'modified' && row) {
+                update(row, message.gift);
+            } else if (message.change === 'removed' && row) {
+                row.remove();
+            } else if (message.change === 'added') {
+                showNotice();
+            }
+        });
+
+        // The server fell behind and dropped events, so the page is stale
+        source.addEventListener('reload', function () {
+            source.close();
+            showNotice();
+        });
+
+        // A refused connection (503 when the server is at capacity) is not
+        // retried by the browser, so try again later ourselves
+        source.onerror = function () {
+            if (source.readyState === EventSource.CLOSED) {
+                setTimeout(connect, 30000);
+            }
+        };
+    }
+
+    connect();
+})();
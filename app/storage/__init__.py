@@ -0,0 +1,57 @@
+"""Datastore backends for app.models.
+
+Every backend exposes the subset of the google-cloud-firestore client API
+that the models use, so User, Group and GiftList run unchanged on any of
+them. STORAGE_BACKEND selects one:
+
+- ``firestore`` (default): Cloud Firestore, database FIRESTORE_DATABASE
+- ``memory``: process-local dicts, for tests, benchmarks and profiling
+- ``sqlite``: an indexed SQLite file at SQLITE_PATH for small self-hosted deployments
+
+STORAGE_LATENCY_MS adds a simulated network round trip to every RPC on the
+local backends, so benchmarks reflect how many round trips a page costs.
+
+``LazyClient`` defers creating the client until its first use and creates
+a new one in each process, so importing the app (including gunicorn's
+preload in the master) opens no connections, and forked workers never
+share a gRPC channel.
+"""
+from app.process_local import ProcessLocal
+
+
+def create_client(config):
+    """Create the datastore client selected by config['STORAGE_BACKEND']"""
+    backend = config.get('STORAGE_BACKEND', 'firestore')
+    latency = config.get('STORAGE_LATENCY_MS', 0) / 1000
+    if backend == 'firestore':
+        from google.cloud import firestore
+        return firestore.Client(database=config.get('FIRESTORE_DATABASE', 'giftster-db'))
+    if backend == 'memory':
+        from app.storage.memory import MemoryClient
+        return MemoryClient(latency)
+    if backend == 'sqlite':
+        from app.storage.sqlite import SQLiteClient
+        return SQLiteClient(config.get('SQLITE_PATH', 'instance/giftster.db'), latency)
+    raise ValueError(f'Unknown STORAGE_BACKEND {backend!r}')
+
+
+class LazyClient:
+    """Proxy that creates the real client on first use, once per process"""
+    
+    def __init__(self, factory):
+        object.__setattr__(self, '_client', ProcessLocal(factory))
+    
+    @property
+    def initialized(self):
+        """True once this process has created its client"""
+        return self._client.initialized
+    
+    def get(self):
+        """The real client, created on the first call in each process"""
+        return self._client.get()
+    
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+    
+    def __setattr__(self, name, value):
+        setattr(self.get(), name, value)
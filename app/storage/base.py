@@ -0,0 +1,762 @@
+"""Firestore-compatible client built on a pluggable local document store.
+
+Only the part of the google-cloud-firestore API that app.models uses is
+implemented. Subclasses provide three primitives: ``_read``, ``_scan`` and
+``_apply``; everything else (references, queries, batches, field
+transforms and preconditions) lives here so every backend behaves alike.
+"""
+import copy
+import queue
+import random
+import string
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from google.api_core import exceptions
+from google.cloud.firestore_v1 import transforms
+from google.cloud.firestore_v1._helpers import ExistsOption, LastUpdateOption
+from google.cloud.firestore_v1.base_aggregation import AggregationResult
+from google.cloud.firestore_v1.watch import ChangeType, DocumentChange
+
+# Firestore rejects commits with more than 500 writes
+MAX_BATCH_WRITES = 500
+
+_ID_ALPHABET = string.ascii_letters + string.digits
+
+
+def _join(path):
+    return '/'.join(path)
+
+
+def _split(path):
+    if isinstance(path, tuple):
+        return path
+    return tuple(segment for segment in path.split('/') if segment)
+
+
+def _get_field(data, field_path):
+    value = data
+    for part in field_path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            raise KeyError(field_path)
+        value = value[part]
+    return value
+
+
+def _set_field(data, field_path, value):
+    parts = field_path.split('.')
+    for part in parts[:-1]:
+        child = data.get(part)
+        if not isinstance(child, dict):
+            child = data[part] = {}
+        data = child
+    data[parts[-1]] = value
+
+
+def _delete_field(data, field_path):
+    parts = field_path.split('.')
+    for part in parts[:-1]:
+        data = data.get(part)
+        if not isinstance(data, dict):
+            return
+    data.pop(parts[-1], None)
+
+
+def _flatten(data, prefix=''):
+    """Yield (field_path, value) leaves for a merge-style set"""
+    for key, value in data.items():
+        path = f'{prefix}{key}'
+        if isinstance(value, dict) and value:
+            yield from _flatten(value, path + '.')
+        else:
+            yield path, value
+
+
+def _apply_value(data, field_path, value, now):
+    """Write one field, resolving Firestore sentinels and transforms"""
+    if value is transforms.DELETE_FIELD:
+        _delete_field(data, field_path)
+        return
+    if value is transforms.SERVER_TIMESTAMP:
+        _set_field(data, field_path, now)
+        return
+    try:
+        current = _get_field(data, field_path)
+    except KeyError:
+        current = None
+    if isinstance(value, transforms.Increment):
+        base = current if isinstance(current, (int, float)) and not isinstance(current, bool) else 0
+        _set_field(data, field_path, base + value.value)
+    elif isinstance(value, transforms.Maximum):
+        _set_field(data, field_path, value.value if current is None else max(current, value.value))
+    elif isinstance(value, transforms.Minimum):
+        _set_field(data, field_path, value.value if current is None else min(current, value.value))
+    elif isinstance(value, transforms.ArrayUnion):
+        items = list(current) if isinstance(current, list) else []
+        items.extend(v for v in value.values if v not in items)
+        _set_field(data, field_path, items)
+    elif isinstance(value, transforms.ArrayRemove):
+        items = list(current) if isinstance(current, list) else []
+        _set_field(data, field_path, [v for v in items if v not in value.values])
+    elif isinstance(value, dict):
+        nested = {}
+        for key, item in value.items():
+            _apply_value(nested, key, item, now)
+        _set_field(data, field_path, nested)
+    else:
+        _set_field(data, field_path, copy.deepcopy(value))
+
+
+def _sort_key(value):
+    """Order values across types the way Firestore does"""
+    if value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (1, value)
+    if isinstance(value, (int, float)):
+        return (2, value)
+    if isinstance(value, datetime):
+        return (3, value)
+    if isinstance(value, str):
+        return (4, value)
+    if isinstance(value, bytes):
+        return (5, value)
+    if isinstance(value, list):
+        return (6, [_sort_key(item) for item in value])
+    if isinstance(value, dict):
+        return (7, sorted((key, _sort_key(item)) for key, item in value.items()))
+    return (8, str(value))
+
+
+class WriteResult:
+    def __init__(self, update_time):
+        self.update_time = update_time
+
+
+class DocumentSnapshot:
+    def __init__(self, reference, data, create_time=None, update_time=None, read_time=None):
+        self.reference = reference
+        self._data = data
+        self.create_time = create_time
+        self.update_time = update_time
+        self.read_time = read_time
+
+    @property
+    def id(self):
+        return self.reference.id
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path):
+        if self._data is None:
+            return None
+        return copy.deepcopy(_get_field(self._data, field_path))
+
+
+class DocumentReference:
+    def __init__(self, client, path):
+        self._client = client
+        self._path = path
+
+    @property
+    def id(self):
+        return self._path[-1]
+
+    @property
+    def path(self):
+        return _join(self._path)
+
+    @property
+    def parent(self):
+        return CollectionReference(self._client, self._path[:-1])
+
+    def __eq__(self, other):
+        return isinstance(other, DocumentReference) and other._path == self._path
+
+    def __hash__(self):
+        return hash(self._path)
+
+    def collection(self, collection_id):
+        return CollectionReference(self._client, self._path + (collection_id,))
+
+    def get(self, field_paths=None, transaction=None):
+        return self._client._get(self, field_paths)
+
+    def create(self, document_data):
+        return self._client._commit([('create', self, document_data, None)])[0]
+
+    def set(self, document_data, merge=False):
+        return self._client._commit([('set', self, document_data, merge)])[0]
+
+    def update(self, field_updates, option=None):
+        return self._client._commit([('update', self, field_updates, option)])[0]
+
+    def delete(self, option=None):
+        return self._client._commit([('delete', self, None, option)])[0].update_time
+
+
+class Query:
+    ASCENDING = 'ASCENDING'
+    DESCENDING = 'DESCENDING'
+
+    def __init__(self, client, parent, collection_id, filters=(), orders=(), limit=None,
+                 start=None, projection=None):
+        self._client = client
+        # parent is the document path owning the collection, or None for a collection group
+        self._parent = parent
+        self._collection_id = collection_id
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._start = start
+        self._projection = projection
+
+    def _copy(self, **changes):
+        fields = {
+            'filters': self._filters,
+            'orders': self._orders,
+            'limit': self._limit,
+            'start': self._start,
+            'projection': self._projection,
+        }
+        fields.update(changes)
+        return Query(self._client, self._parent, self._collection_id, **fields)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path, direction=ASCENDING):
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def select(self, field_paths):
+        return self._copy(projection=tuple(field_paths))
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(start=(document_fields_or_snapshot, False))
+
+    def start_at(self, document_fields_or_snapshot):
+        return self._copy(start=(document_fields_or_snapshot, True))
+
+    def count(self, alias='count'):
+        return _CountQuery(self, alias)
+
+    def stream(self, transaction=None):
+        return iter(self._client._run_query(self))
+
+    def get(self, transaction=None):
+        return list(self.stream(transaction=transaction))
+
+    def on_snapshot(self, callback):
+        return self._client._listen(self, callback)
+
+    def _covers(self, path):
+        """True if a document path belongs to the collection(s) this query reads"""
+        if len(path) < 2 or path[-2] != self._collection_id:
+            return False
+        return self._parent is None or path[:-2] == self._parent
+
+    def _value(self, path, data, field_path):
+        if field_path == '__name__':
+            return _join(path)
+        return _get_field(data, field_path)
+
+    def _document_path(self, value):
+        """Resolve a document reference or bare ID used against __name__"""
+        if isinstance(value, DocumentReference):
+            return value.path
+        if isinstance(value, str) and '/' not in value and self._parent is not None:
+            return _join(self._parent + (self._collection_id, value))
+        return value
+
+    def _matches(self, path, data):
+        for field_path, op, expected in self._filters:
+            if field_path == '__name__':
+                if op in ('in', 'not-in'):
+                    expected = [self._document_path(item) for item in expected]
+                else:
+                    expected = self._document_path(expected)
+            try:
+                value = self._value(path, data, field_path)
+            except KeyError:
+                if op == '!=' or op == 'not-in':
+                    continue
+                return False
+            if op == '==':
+                ok = value == expected
+            elif op == '!=':
+                ok = value != expected
+            elif op == '<':
+                ok = _sort_key(value) < _sort_key(expected)
+            elif op == '<=':
+                ok = _sort_key(value) <= _sort_key(expected)
+            elif op == '>':
+                ok = _sort_key(value) > _sort_key(expected)
+            elif op == '>=':
+                ok = _sort_key(value) >= _sort_key(expected)
+            elif op == 'in':
+                ok = value in expected
+            elif op == 'not-in':
+                ok = value not in expected
+            elif op == 'array_contains':
+                ok = isinstance(value, list) and expected in value
+            elif op == 'array_contains_any':
+                ok = isinstance(value, list) and any(item in value for item in expected)
+            else:
+                raise ValueError(f'Unsupported operator {op!r}')
+            if not ok:
+                return False
+        return True
+
+    def _order_key(self, path, data):
+        key = []
+        for field_path, direction in self._orders + (('__name__', self.ASCENDING),):
+            value = _sort_key(self._value(path, data, field_path))
+            key.append(_Reversed(value) if direction == self.DESCENDING else value)
+        return tuple(key)
+
+    def _cursor_key(self):
+        cursor, _ = self._start
+        if isinstance(cursor, DocumentSnapshot):
+            return self._order_key(cursor.reference._path, cursor._data or {})
+        if isinstance(cursor, dict):
+            values = [cursor.get(field) for field, _ in self._orders]
+        else:
+            values = list(cursor)
+        key = []
+        for value, (field_path, direction) in zip(values, self._orders + (('__name__', self.ASCENDING),)):
+            if field_path == '__name__':
+                value = self._document_path(value)
+            value = _sort_key(value)
+            key.append(_Reversed(value) if direction == self.DESCENDING else value)
+        return tuple(key)
+
+    def _execute(self, rows):
+        """Filter, order, page and project raw (path, data, ct, ut) rows"""
+        for field_path, _ in self._orders:
+            rows = [row for row in rows if _has_field(row[1], field_path)]
+        rows = [row for row in rows if self._matches(row[0], row[1])]
+        rows.sort(key=lambda row: self._order_key(row[0], row[1]))
+        if self._start is not None:
+            cursor = self._cursor_key()
+            inclusive = self._start[1]
+            width = len(cursor)
+            rows = [
+                row for row in rows
+                if (self._order_key(row[0], row[1])[:width] >= cursor if inclusive
+                    else self._order_key(row[0], row[1])[:width] > cursor)
+            ]
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        return rows
+
+
+def _has_field(data, field_path):
+    if field_path == '__name__':
+        return True
+    try:
+        _get_field(data, field_path)
+    except KeyError:
+        return False
+    return True
+
+
+class _Reversed:
+    """Sort key wrapper for descending order"""
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return self.value > other.value
+
+    def __le__(self, other):
+        return self.value >= other.value
+
+    def __gt__(self, other):
+        return self.value < other.value
+
+    def __ge__(self, other):
+        return self.value <= other.value
+
+
+class _CountQuery:
+    def __init__(self, query, alias):
+        self._query = query
+        self._alias = alias
+
+    def get(self, transaction=None):
+        count = self._query._client._run_count(self._query)
+        return [[AggregationResult(alias=self._alias, value=count)]]
+
+
+class Watch:
+    """Listener returned by Query.on_snapshot
+
+    Like the real client it calls back on its own thread, first with every
+    matching document as ADDED and then once per commit that changes the
+    results. Filters and ordering apply; limits and cursors are ignored.
+    Only commits made through the same client are seen, so with the SQLite
+    backend each process sees just its own writes.
+    """
+
+    def __init__(self, client, query, callback):
+        self._client = client
+        self._query = query
+        self._callback = callback
+        self._docs = {}
+        self._events = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='snapshot-listener', daemon=True)
+
+    def unsubscribe(self):
+        self._client._unlisten(self)
+        self._events.put(None)
+
+    def _push(self, records, initial=False):
+        """Queue {path: record or None} changes for delivery"""
+        self._events.put((records, initial))
+
+    def _run(self):
+        while True:
+            event = self._events.get()
+            if event is None:
+                return
+            records, initial = event
+            changes = []
+            for path, record in records.items():
+                matched = record is not None and self._matches(path, record[0])
+                if matched:
+                    snapshot = self._client._snapshot(DocumentReference(self._client, path), record)
+                    kind = ChangeType.MODIFIED if path in self._docs else ChangeType.ADDED
+                    self._docs[path] = snapshot
+                    changes.append(DocumentChange(kind, snapshot, -1, -1))
+                elif path in self._docs:
+                    changes.append(DocumentChange(ChangeType.REMOVED, self._docs.pop(path), -1, -1))
+            if changes or initial:
+                docs = sorted(self._docs.values(), key=lambda doc: self._query._order_key(doc.reference._path, doc._data))
+                self._callback(docs, changes, datetime.now(timezone.utc))
+
+    def _matches(self, path, data):
+        if not all(_has_field(data, field_path) for field_path, _ in self._query._orders):
+            return False
+        return self._query._matches(path, data)
+
+
+class CollectionReference(Query):
+    def __init__(self, client, path):
+        super().__init__(client, path[:-1] or (), path[-1])
+        self._path = path
+
+    @property
+    def id(self):
+        return self._path[-1]
+
+    @property
+    def parent(self):
+        if len(self._path) == 1:
+            return None
+        return DocumentReference(self._client, self._path[:-1])
+
+    def document(self, document_id=None):
+        if document_id is None:
+            document_id = ''.join(random.choices(_ID_ALPHABET, k=20))
+        return DocumentReference(self._client, self._path + (document_id,))
+
+    def add(self, document_data):
+        ref = self.document()
+        return ref.set(document_data).update_time, ref
+
+    def list_documents(self):
+        return [DocumentReference(self._client, row[0]) for row in self._client._scan(self._path[:-1], self.id, ())]
+
+
+class WriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def __len__(self):
+        return len(self._writes)
+
+    def create(self, reference, document_data):
+        self._writes.append(('create', reference, document_data, None))
+
+    def set(self, reference, document_data, merge=False):
+        self._writes.append(('set', reference, document_data, merge))
+
+    def update(self, reference, field_updates, option=None):
+        self._writes.append(('update', reference, field_updates, option))
+
+    def delete(self, reference, option=None):
+        self._writes.append(('delete', reference, None, option))
+
+    def commit(self):
+        writes, self._writes = self._writes, []
+        return self._client._commit(writes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+
+
+class DocumentClient:
+    """Base class for local Firestore stand-ins"""
+
+    def __init__(self, latency=0.0):
+        self._lock = threading.RLock()
+        # Seconds slept before each RPC, outside the lock, to imitate
+        # Firestore's network round trip in benchmarks
+        self.latency = latency
+        self._last_time = datetime.now(timezone.utc)
+        # RPCs and billable document reads/writes the same calls would cost
+        # on Firestore, for benchmarks
+        self.stats = {'round_trips': 0, 'reads': 0, 'writes': 0}
+        self._watches = []
+
+    # -- backend primitives -------------------------------------------------
+
+    def _read(self, path):
+        """Return (data, create_time, update_time) for a document path, or None"""
+        raise NotImplementedError
+
+    def _scan(self, parent, collection_id, equals):
+        """Yield (path, data, create_time, update_time) rows of a collection.
+
+        ``parent`` is the owning document path, or None to scan every
+        collection named ``collection_id``. ``equals`` holds (field, value)
+        equality filters a backend may answer from an index; rows are
+        filtered again afterwards, so ignoring them is always correct.
+        """
+        raise NotImplementedError
+
+    def _apply(self, changes):
+        """Persist {path: (data, create_time, update_time) or None} atomically"""
+        raise NotImplementedError
+
+    @contextmanager
+    def _write_transaction(self):
+        """Hold the store's write lock while a commit checks and applies its writes"""
+        yield
+
+    # -- Firestore client API -----------------------------------------------
+
+    def collection(self, *path):
+        return CollectionReference(self, _split('/'.join(path)))
+
+    def document(self, *path):
+        return DocumentReference(self, _split('/'.join(path)))
+
+    def collection_group(self, collection_id):
+        return Query(self, None, collection_id)
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def write_option(self, **kwargs):
+        if len(kwargs) != 1:
+            raise TypeError('Exactly one write option is required')
+        name, value = kwargs.popitem()
+        if name == 'last_update_time':
+            return LastUpdateOption(value)
+        if name == 'exists':
+            return ExistsOption(value)
+        raise TypeError(f'Unknown write option {name!r}')
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        references = list(references)
+        self._round_trip()
+        with self._lock:
+            records = [(ref, self._read(ref._path)) for ref in references]
+            self._record(reads=len(records))
+        for ref, record in records:
+            yield self._snapshot(ref, record, field_paths)
+
+    def close(self):
+        pass
+
+    def reset_stats(self):
+        """Zero the RPC counters and return their previous values"""
+        with self._lock:
+            stats = dict(self.stats)
+            for key in self.stats:
+                self.stats[key] = 0
+        return stats
+
+    # -- shared implementation ----------------------------------------------
+
+    def _round_trip(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _record(self, reads=0, writes=0):
+        self.stats['round_trips'] += 1
+        self.stats['reads'] += reads
+        self.stats['writes'] += writes
+
+    def _snapshot(self, reference, record, field_paths=None):
+        read_time = datetime.now(timezone.utc)
+        if record is None:
+            return DocumentSnapshot(reference, None, read_time=read_time)
+        data, create_time, update_time = record
+        data = copy.deepcopy(data)
+        if field_paths is not None:
+            data = _project(data, field_paths)
+        return DocumentSnapshot(reference, data, create_time, update_time, read_time)
+
+    def _get(self, reference, field_paths=None):
+        self._round_trip()
+        with self._lock:
+            record = self._read(reference._path)
+            self._record(reads=1)
+        return self._snapshot(reference, record, field_paths)
+
+    def _query_rows(self, query):
+        equals = tuple(
+            (field, value) for field, op, value in query._filters
+            if op == '==' and field != '__name__' and isinstance(value, (str, int, float))
+        )
+        with self._lock:
+            rows = list(self._scan(query._parent, query._collection_id, equals))
+        return query._execute(rows)
+
+    def _run_query(self, query):
+        self._round_trip()
+        rows = self._query_rows(query)
+        with self._lock:
+            # Firestore bills one read even for an empty result
+            self._record(reads=max(len(rows), 1))
+        return [
+            self._snapshot(DocumentReference(self, path), (data, ct, ut), query._projection)
+            for path, data, ct, ut in rows
+        ]
+
+    def _run_count(self, query):
+        self._round_trip()
+        count = len(self._query_rows(query))
+        with self._lock:
+            # Aggregations bill one read per 1000 index entries
+            self._record(reads=count // 1000 + 1)
+        return count
+
+    def _listen(self, query, callback):
+        watch = Watch(self, query, callback)
+        with self._lock:
+            # Registered under the lock, so no commit falls between the
+            # initial snapshot and the first change
+            rows = self._scan(query._parent, query._collection_id, ())
+            watch._push({path: (data, ct, ut) for path, data, ct, ut in rows}, initial=True)
+            self._watches.append(watch)
+        watch._thread.start()
+        return watch
+
+    def _unlisten(self, watch):
+        with self._lock:
+            if watch in self._watches:
+                self._watches.remove(watch)
+
+    def _notify(self, changes):
+        """Hand a commit's {path: record or None} changes to interested listeners"""
+        for watch in self._watches:
+            records = {path: record for path, record in changes.items() if watch._query._covers(path)}
+            if records:
+                watch._push(records)
+
+    def _tick(self):
+        """Return a strictly increasing commit timestamp"""
+        now = datetime.now(timezone.utc)
+        if now <= self._last_time:
+            now = self._last_time + timedelta(microseconds=1)
+        self._last_time = now
+        return now
+
+    def _commit(self, writes):
+        if len(writes) > MAX_BATCH_WRITES:
+            raise exceptions.InvalidArgument(f'maximum {MAX_BATCH_WRITES} writes allowed per request')
+        self._round_trip()
+        with self._lock, self._write_transaction():
+            # A rejected commit still costs a round trip
+            self.stats['round_trips'] += 1
+            now = self._tick()
+            changes = {}
+
+            def current(path):
+                if path in changes:
+                    return changes[path]
+                return self._read(path)
+
+            for kind, ref, data, option in writes:
+                path = ref._path
+                record = current(path)
+                _check_option(option, record, ref)
+                if kind == 'create':
+                    if record is not None:
+                        raise exceptions.AlreadyExists(f'Document already exists: {ref.path}')
+                    changes[path] = (_build({}, data, now, merge=False), now, now)
+                elif kind == 'set':
+                    # option carries the merge flag for set()
+                    base = copy.deepcopy(record[0]) if record is not None and option else {}
+                    new_data = _build(base, data, now, merge=bool(option))
+                    created = record[1] if record is not None else now
+                    changes[path] = (new_data, created, now)
+                elif kind == 'update':
+                    if record is None:
+                        raise exceptions.NotFound(f'No document to update: {ref.path}')
+                    new_data = copy.deepcopy(record[0])
+                    for field_path, value in data.items():
+                        _apply_value(new_data, field_path, value, now)
+                    changes[path] = (new_data, record[1], now)
+                elif kind == 'delete':
+                    changes[path] = None
+            self._apply(changes)
+            self.stats['writes'] += len(writes)
+            self._notify(changes)
+        return [WriteResult(now) for _ in writes]
+
+
+def _build(base, data, now, merge):
+    if merge:
+        for field_path, value in _flatten(data):
+            _apply_value(base, field_path, value, now)
+        return base
+    for key, value in data.items():
+        _apply_value(base, key, value, now)
+    return base
+
+
+def _check_option(option, record, ref):
+    # set() writes pass their merge flag in the option slot
+    if option is None or isinstance(option, bool):
+        return
+    if isinstance(option, LastUpdateOption):
+        if record is None or record[2] != option._last_update_time:
+            raise exceptions.FailedPrecondition(f'Document was modified: {ref.path}')
+    elif isinstance(option, ExistsOption):
+        if (record is not None) != option._exists:
+            raise exceptions.FailedPrecondition(f'Existence precondition failed: {ref.path}')
+
+
+def _project(data, field_paths):
+    projected = {}
+    for field_path in field_paths:
+        try:
+            _set_field(projected, field_path, _get_field(data, field_path))
+        except KeyError:
+            pass
+    return projected
@@ -0,0 +1,35 @@
+"""In-memory document store, for tests, benchmarks and local development"""
+from app.storage.base import DocumentClient
+
+
+class MemoryClient(DocumentClient):
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self._documents = {}
+        # collection path -> set of document IDs, so listing a collection
+        # never walks the whole store
+        self._collections = {}
+
+    def _read(self, path):
+        return self._documents.get(path)
+
+    def _scan(self, parent, collection_id, equals):
+        if parent is not None:
+            collection_paths = [parent + (collection_id,)]
+        else:
+            collection_paths = [path for path in self._collections if path[-1] == collection_id]
+        for collection_path in collection_paths:
+            for document_id in self._collections.get(collection_path, ()):
+                path = collection_path + (document_id,)
+                data, create_time, update_time = self._documents[path]
+                yield path, data, create_time, update_time
+
+    def _apply(self, changes):
+        for path, record in changes.items():
+            collection_ids = self._collections.setdefault(path[:-1], set())
+            if record is None:
+                self._documents.pop(path, None)
+                collection_ids.discard(path[-1])
+            else:
+                self._documents[path] = record
+                collection_ids.add(path[-1])
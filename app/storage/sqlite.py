@@ -0,0 +1,125 @@
+"""SQLite document store for small self-hosted deployments.
+
+Documents are stored as JSON in a single table. Collection listings use the
+(parent, collection_id) index, and the fields app.models filters on get
+expression indexes, so logins, join codes, memberships and per-user gift
+lists are all answered from an index.
+"""
+import json
+import os
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+
+from app.storage.base import DocumentClient, _join, _split
+
+# Fields queried with equality filters by app.models
+INDEXED_FIELDS = ('email', 'join_code', 'user_id', 'giver_id', 'claimer_id')
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS documents (
+    path TEXT PRIMARY KEY,
+    parent TEXT NOT NULL,
+    collection_id TEXT NOT NULL,
+    data TEXT NOT NULL,
+    create_time TEXT NOT NULL,
+    update_time TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS documents_collection ON documents (parent, collection_id);
+CREATE INDEX IF NOT EXISTS documents_collection_group ON documents (collection_id);
+'''
+
+_FIELD_INDEX = '''
+CREATE INDEX IF NOT EXISTS documents_{field} ON documents (collection_id, json_extract(data, '$.{field}'), parent)
+'''
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    raise TypeError(f'Cannot store {type(value).__name__} in SQLite backend')
+
+
+def _decode(obj):
+    if len(obj) == 1 and '__datetime__' in obj:
+        return datetime.fromisoformat(obj['__datetime__'])
+    return obj
+
+
+class SQLiteClient(DocumentClient):
+    def __init__(self, path, latency=0.0):
+        super().__init__(latency)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Autocommit mode; commits open their own IMMEDIATE transaction so
+        # several worker processes can share one database file
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA busy_timeout=5000')
+        self._conn.executescript(_SCHEMA)
+        for field in INDEXED_FIELDS:
+            self._conn.execute(_FIELD_INDEX.format(field=field))
+
+    def _row(self, row):
+        path, data, create_time, update_time = row
+        return (
+            _split(path),
+            json.loads(data, object_hook=_decode),
+            datetime.fromisoformat(create_time),
+            datetime.fromisoformat(update_time),
+        )
+
+    def _read(self, path):
+        row = self._conn.execute(
+            'SELECT path, data, create_time, update_time FROM documents WHERE path = ?',
+            (_join(path),),
+        ).fetchone()
+        if row is None:
+            return None
+        return self._row(row)[1:]
+
+    def _scan(self, parent, collection_id, equals):
+        sql = 'SELECT path, data, create_time, update_time FROM documents WHERE collection_id = ?'
+        params = [collection_id]
+        if parent is not None:
+            sql += ' AND parent = ?'
+            params.append(_join(parent))
+        for field, value in equals:
+            if field in INDEXED_FIELDS:
+                sql += f" AND json_extract(data, '$.{field}') = ?"
+                params.append(value)
+        for row in self._conn.execute(sql, params).fetchall():
+            yield self._row(row)
+
+    def _apply(self, changes):
+        for path, record in changes.items():
+            if record is None:
+                self._conn.execute('DELETE FROM documents WHERE path = ?', (_join(path),))
+                continue
+            data, create_time, update_time = record
+            self._conn.execute(
+                'INSERT OR REPLACE INTO documents (path, parent, collection_id, data, create_time, update_time) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (
+                    _join(path),
+                    _join(path[:-2]),
+                    path[-2],
+                    json.dumps(data, default=_encode),
+                    create_time.isoformat(),
+                    update_time.isoformat(),
+                ),
+            )
+
+    @contextmanager
+    def _write_transaction(self):
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self._conn.execute('ROLLBACK')
+            raise
+        self._conn.execute('COMMIT')
+
+    def close(self):
+        self._conn.close()
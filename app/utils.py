@@ -1,11 +1,12 @@
-import resend
 from itsdangerous import URLSafeTimedSerializer
 from flask import current_app
+from app.mail import DEFAULT_SENDER, email_queue
 
 # Helper functions
 def send_reset_email(user_email, reset_url):
-    resend.Emails.send({
-        "from": "Giftster <noreply@mail.giftster.app>",
+    """Queue the password reset email; it is sent in the background"""
+    return email_queue.send({
+        "from": DEFAULT_SENDER,
         "to": user_email,
         "subject": "Reset Your Giftster Password",
         "html": f'''<p>Click <a href="{reset_url}">here</a> to reset your password.</p>'''
@@ -0,0 +1,4 @@
+"""Benchmarks for the Flask routes against a local stand-in for Firestore.
+
+Run ``python -m bench --help`` from the repository root.
+"""
@@ -0,0 +1,4 @@
+import sys
+from bench.harness import main
+
+sys.exit(main())
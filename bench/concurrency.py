@@ -0,0 +1,122 @@
+"""Concurrent claim benchmark.
+
+Seeds one group and has many members click Claim on the same gifts at the
+same moment, each through their own Flask test client on its own thread.
+Afterwards it checks that every gift ended up with exactly one claimer and
+that the claim counters agree with the gift documents. It reports latency
+and datastore round trips per request.
+
+    python -m bench.concurrency --members 50 --gifts 20 --threads 16
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault('STORAGE_BACKEND', 'memory')
+os.environ.setdefault('DATASTORE_LOG', '0')
+
+from app import app
+from app.models import GiftList, get_claim_counts
+from bench.datagen import seed
+from bench.harness import percentile, reset_datastore, set_latency
+
+
+def run(members, gifts, threads, backend='memory', sqlite_path=None, latency_ms=5):
+    db = reset_datastore(backend, sqlite_path)
+    # One gift per member, none claimed, so every gift is contested
+    dataset = seed(users=members, groups=1, members=members, gifts=1, claim_ratio=0)
+    group_id = dataset.group_ids[0]
+    targets = [gift_id for _, gift_id in dataset.claimable][:gifts]
+    claimers = dataset.user_ids[:threads]
+    
+    clients = {}
+    for user_id in claimers:
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = user_id
+            session['_fresh'] = True
+        clients[user_id] = client
+    
+    # Without simulated network latency the requests barely overlap
+    set_latency(db, latency_ms)
+    latencies = []
+    latency_lock = threading.Lock()
+    db.reset_stats()
+    
+    def contend(gift_id):
+        barrier = threading.Barrier(len(claimers))
+        
+        def click(user_id):
+            barrier.wait()
+            start = time.perf_counter()
+            clients[user_id].post(f'/claim-item/{group_id}/{gift_id}')
+            with latency_lock:
+                latencies.append((time.perf_counter() - start) * 1000)
+        
+        with ThreadPoolExecutor(max_workers=len(claimers)) as pool:
+            list(pool.map(click, claimers))
+    
+    start = time.perf_counter()
+    for gift_id in targets:
+        contend(gift_id)
+    elapsed = time.perf_counter() - start
+    stats = db.reset_stats()
+    set_latency(db, 0)
+    
+    # Verify: each gift has one claimer and the counters match the gifts
+    gifts_by_id = {gift.id: gift for gift in GiftList.get_all_in_group(group_id)}
+    claimed = [gifts_by_id[gift_id] for gift_id in targets if gifts_by_id[gift_id].is_claimed]
+    counted = sum(
+        sum(counts.values())
+        for user_id in dataset.user_ids
+        for counts in get_claim_counts(user_id, [group_id]).values()
+    )
+    requests = len(latencies)
+    return {
+        'members': members,
+        'gifts': len(targets),
+        'threads': len(claimers),
+        'latency_ms_per_rpc': latency_ms,
+        'requests': requests,
+        'seconds': elapsed,
+        'claimed_gifts': len(claimed),
+        'unclaimed_gifts': len(targets) - len(claimed),
+        'counter_total': counted,
+        'consistent': counted == len(claimed),
+        'latency_ms': {
+            'p50': percentile(latencies, 50),
+            'p99': percentile(latencies, 99),
+            'mean': statistics.fmean(latencies) if latencies else None,
+        },
+        'per_request': {key: value / requests for key, value in stats.items()} if requests else {},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bench.concurrency', description=__doc__.splitlines()[0])
+    parser.add_argument('--members', type=int, default=50)
+    parser.add_argument('--gifts', type=int, default=20, help='gifts to contend for, one at a time')
+    parser.add_argument('--threads', type=int, default=16, help='members clicking Claim at once')
+    parser.add_argument('--backend', choices=('memory', 'sqlite'), default='memory')
+    parser.add_argument('--sqlite-path', default=os.path.join('instance', 'bench.db'))
+    parser.add_argument('--latency-ms', type=float, default=5,
+                        help='simulated round-trip time added to every datastore RPC')
+    parser.add_argument('--output', help='also write the result as JSON to this file')
+    args = parser.parse_args(argv)
+    
+    result = run(args.members, args.gifts, args.threads, args.backend,
+                 args.sqlite_path if args.backend == 'sqlite' else None, args.latency_ms)
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    return 0 if result['consistent'] and result['unclaimed_gifts'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
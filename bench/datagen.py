@@ -0,0 +1,77 @@
+"""Seeded synthetic data for benchmarks.
+
+Groups, memberships, gifts and claims are written through app.models so
+every derived document (membership index, claim counters, ...) is created
+exactly as in production. Users are written directly with one shared
+password hash, since hashing a password per user would dominate seeding.
+"""
+import random
+from dataclasses import dataclass, field
+
+from werkzeug.security import generate_password_hash
+
+from app import models
+from app.models import GiftList, Group
+
+PASSWORD = 'benchmark-password'
+
+
+@dataclass
+class Dataset:
+    user_ids: list
+    group_ids: list
+    # The user whose pages are benchmarked; a member of every group
+    viewer_id: str
+    # Gifts in each group the viewer may claim, as (group_id, gift_id)
+    claimable: list = field(default_factory=list)
+
+
+def seed(users, groups, members, gifts, claim_ratio=0.2, seed=0):
+    """Create users, groups of members, gifts per member and some claims"""
+    if members > users:
+        raise ValueError('members per group cannot exceed the number of users')
+    rng = random.Random(seed)
+    password_hash = generate_password_hash(PASSWORD)
+    
+    user_ids = []
+    batch = models.db.batch()
+    for i in range(users):
+        user_ref = models.db.collection('users').document(f'user-{i:06d}')
+        email = f'user{i}@bench.example'
+        batch.set(user_ref, {
+            'first_name': f'First{i}',
+            'last_name': f'Last{i}',
+            'email': email,
+            'password_hash': password_hash
+        })
+        # Same email index document User.create writes
+        batch.set(models._email_index_ref(email), {'user_id': user_ref.id, 'email': email})
+        user_ids.append(user_ref.id)
+        if len(batch) >= models.BATCH_WRITE_LIMIT - 1:
+            batch.commit()
+            batch = models.db.batch()
+    batch.commit()
+    
+    viewer_id = user_ids[0]
+    dataset = Dataset(user_ids=user_ids, group_ids=[], viewer_id=viewer_id)
+    for g in range(groups):
+        group = Group.create(f'Group {g}', f'Synthetic group {g}', viewer_id)
+        dataset.group_ids.append(group.id)
+        member_ids = [viewer_id] + rng.sample(user_ids[1:], members - 1)
+        for user_id in member_ids[1:]:
+            group.add_member(user_id)
+        
+        for user_id in member_ids:
+            for k in range(gifts):
+                gift = GiftList.create(group.id, user_id, f'Gift {k} for {user_id}',
+                                       'Synthetic item', 'https://example.com/item')
+                if user_id == viewer_id:
+                    continue
+                if rng.random() < claim_ratio:
+                    # Claimed by someone other than the viewer, so the
+                    # viewer's "Need Gifts" count is not trivially zero
+                    claimer_id = rng.choice([m for m in member_ids if m not in (user_id, viewer_id)] or [viewer_id])
+                    gift.claim(claimer_id)
+                else:
+                    dataset.claimable.append((group.id, gift.id))
+    return dataset
@@ -0,0 +1,196 @@
+"""Drive the Flask routes through the test client and record latency and RPCs.
+
+For each data size a fresh local datastore is seeded, then every route is
+requested repeatedly as the benchmark viewer. Per route the harness reports
+latency percentiles and the mean Firestore reads, writes and round trips per
+request, and writes everything to a JSON file so revisions can be compared.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+# The app picks its datastore at import time
+os.environ.setdefault('STORAGE_BACKEND', 'memory')
+os.environ.setdefault('DATASTORE_LOG', '0')
+
+from app import app, models
+from app.instrumentation import instrument
+from app.storage import create_client
+from bench.datagen import seed
+
+# (name, users, groups, members per group, gifts per member)
+DEFAULT_SIZES = [
+    ('small', 20, 3, 10, 5),
+    ('medium', 200, 3, 100, 5),
+    ('large', 1500, 2, 1000, 3),
+]
+
+ROUTES = ('dashboard', 'group_detail', 'claim_item')
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def reset_datastore(backend, sqlite_path=None):
+    """Point app.models at a fresh datastore and clear process-wide caches"""
+    config = dict(app.config, STORAGE_BACKEND=backend, STORAGE_LATENCY_MS=0)
+    if sqlite_path:
+        if os.path.exists(sqlite_path):
+            os.remove(sqlite_path)
+        config['SQLITE_PATH'] = sqlite_path
+    models.db = instrument(create_client(config))
+    models.user_cache.clear()
+    return models.db
+
+
+def set_latency(db, latency_ms):
+    """Start simulating network latency once seeding is done"""
+    # models.db is normally the instrumentation proxy around the backend
+    getattr(db, '_target', db).latency = latency_ms / 1000
+
+
+def request_for(route, dataset, iteration):
+    """Return (method, url) for one iteration of a route"""
+    group_id = dataset.group_ids[0]
+    if route == 'dashboard':
+        return 'GET', '/dashboard'
+    if route == 'group_detail':
+        return 'GET', f'/group/{group_id}'
+    if route == 'claim_item':
+        group_id, gift_id = dataset.claimable[iteration % len(dataset.claimable)]
+        return 'POST', f'/claim-item/{group_id}/{gift_id}'
+    raise ValueError(route)
+
+
+def bench_route(client, db, route, dataset, iterations):
+    latencies = []
+    totals = {'round_trips': 0, 'reads': 0, 'writes': 0}
+    method, url = request_for(route, dataset, 0)
+    client.open(url, method=method)  # warm up
+    for i in range(iterations):
+        method, url = request_for(route, dataset, i + 1)
+        db.reset_stats()
+        start = time.perf_counter()
+        response = client.open(url, method=method)
+        # Streamed pages do their datastore reads while the body is read
+        response.get_data()
+        latencies.append((time.perf_counter() - start) * 1000)
+        if response.status_code >= 400:
+            raise RuntimeError(f'{method} {url} returned {response.status_code}')
+        for key, value in db.reset_stats().items():
+            totals[key] += value
+    return {
+        'iterations': iterations,
+        'latency_ms': {
+            'p50': percentile(latencies, 50),
+            'p90': percentile(latencies, 90),
+            'p99': percentile(latencies, 99),
+            'mean': statistics.fmean(latencies),
+            'max': max(latencies),
+        },
+        'per_request': {key: value / iterations for key, value in totals.items()},
+    }
+
+
+def run(sizes, iterations, backend='memory', sqlite_path=None, routes=ROUTES, seed_value=0, latency_ms=0, log=print):
+    results = []
+    for name, users, groups, members, gifts in sizes:
+        db = reset_datastore(backend, sqlite_path)
+        start = time.perf_counter()
+        dataset = seed(users, groups, members, gifts, seed=seed_value)
+        log(f'{name}: seeded {users} users, {groups} groups x {members} members x {gifts} gifts '
+            f'in {time.perf_counter() - start:.1f}s')
+        set_latency(db, latency_ms)
+        
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = dataset.viewer_id
+            session['_fresh'] = True
+        
+        size_result = {
+            'name': name,
+            'users': users,
+            'groups': groups,
+            'members': members,
+            'gifts': gifts,
+            'routes': {},
+        }
+        for route in routes:
+            route_result = bench_route(client, db, route, dataset, iterations)
+            size_result['routes'][route] = route_result
+            log(f"  {route:<13} p50 {route_result['latency_ms']['p50']:8.2f} ms  "
+                f"p99 {route_result['latency_ms']['p99']:8.2f} ms  "
+                f"reads {route_result['per_request']['reads']:8.1f}  "
+                f"writes {route_result['per_request']['writes']:5.1f}  "
+                f"round trips {route_result['per_request']['round_trips']:6.1f}")
+        results.append(size_result)
+    return results
+
+
+def parse_size(value):
+    """Parse NAME:USERS:GROUPS:MEMBERS:GIFTS"""
+    name, *numbers = value.split(':')
+    if len(numbers) != 4:
+        raise argparse.ArgumentTypeError('expected NAME:USERS:GROUPS:MEMBERS:GIFTS')
+    return (name, *(int(n) for n in numbers))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bench', description=__doc__.splitlines()[0])
+    parser.add_argument('--size', dest='sizes', type=parse_size, action='append',
+                        help='data size as NAME:USERS:GROUPS:MEMBERS:GIFTS (repeatable)')
+    parser.add_argument('--iterations', type=int, default=20, help='timed requests per route')
+    parser.add_argument('--route', dest='routes', action='append', choices=ROUTES,
+                        help='only benchmark these routes (repeatable)')
+    parser.add_argument('--backend', choices=('memory', 'sqlite'), default='memory')
+    parser.add_argument('--sqlite-path', default=os.path.join('instance', 'bench.db'))
+    parser.add_argument('--latency-ms', type=float, default=0,
+                        help='simulated round-trip time added to every datastore RPC')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='JSON results file (default bench/results/<timestamp>.json)')
+    args = parser.parse_args(argv)
+    
+    results = run(
+        args.sizes or DEFAULT_SIZES,
+        args.iterations,
+        backend=args.backend,
+        sqlite_path=args.sqlite_path if args.backend == 'sqlite' else None,
+        routes=args.routes or ROUTES,
+        seed_value=args.seed,
+        latency_ms=args.latency_ms,
+    )
+    
+    report = {
+        'revision': git_revision(),
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'backend': args.backend,
+        'latency_ms': args.latency_ms,
+        'iterations': args.iterations,
+        'sizes': results,
+    }
+    output = args.output or os.path.join(
+        'bench', 'results', datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Wrote {output}', file=sys.stderr)
+    return 0
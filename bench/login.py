@@ -0,0 +1,121 @@
+"""Login throughput benchmark.
+
+Posts valid logins from many threads at once, at each of several
+concurrency levels, while one more thread keeps requesting a page that does
+no hashing. Reports login throughput and latency, how many logins were
+shed because password hashing was saturated, and how much the bystander
+page slowed down.
+
+    python -m bench.login --levels 1,4,16,64 --logins 64 --workers 1 --max-pending 8
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault('STORAGE_BACKEND', 'memory')
+os.environ.setdefault('DATASTORE_LOG', '0')
+os.environ.setdefault('MAIL_TRANSPORT', 'memory')
+
+from app import app
+from app.passwords import email_throttle, ip_throttle, password_hasher
+from bench.datagen import PASSWORD, seed
+from bench.harness import percentile, reset_datastore
+
+
+def summarize(latencies):
+    return {
+        'p50': percentile(latencies, 50),
+        'p99': percentile(latencies, 99),
+        'mean': statistics.fmean(latencies) if latencies else None,
+    }
+
+
+def run_level(concurrency, logins, emails):
+    latencies = []
+    outcomes = {'ok': 0, 'shed': 0, 'failed': 0}
+    lock = threading.Lock()
+    
+    def login(i):
+        client = app.test_client()
+        start = time.perf_counter()
+        response = client.post('/login', data={'email': emails[i % len(emails)], 'password': PASSWORD},
+                               environ_base={'REMOTE_ADDR': f'10.0.{i // 250}.{i % 250 + 1}'})
+        elapsed = (time.perf_counter() - start) * 1000
+        location = response.headers.get('Location', '')
+        outcome = 'ok' if location.endswith('/dashboard') else 'shed' if response.status_code == 302 else 'failed'
+        with lock:
+            latencies.append(elapsed)
+            outcomes[outcome] += 1
+    
+    # A route that never hashes, to see whether logins starve other requests
+    bystander = []
+    done = threading.Event()
+    
+    def browse():
+        client = app.test_client()
+        while not done.is_set():
+            start = time.perf_counter()
+            client.get('/login')
+            bystander.append((time.perf_counter() - start) * 1000)
+    
+    browser = threading.Thread(target=browse)
+    browser.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(login, range(logins)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    browser.join()
+    
+    return {
+        'concurrency': concurrency,
+        'logins': logins,
+        'seconds': elapsed,
+        'logins_per_second': outcomes['ok'] / elapsed,
+        'outcomes': outcomes,
+        'login_latency_ms': summarize(latencies),
+        'bystander_latency_ms': summarize(bystander),
+    }
+
+
+def run(levels, logins, workers, max_pending, method):
+    reset_datastore('memory')
+    dataset = seed(users=min(logins, 200), groups=1, members=2, gifts=0)
+    emails = [f'user{i}@bench.example' for i in range(len(dataset.user_ids))]
+    
+    # Keep every seeded hash valid for the configured method, so logins do
+    # not all trigger a rehash
+    password_hasher.configure(method=method, workers=workers, max_pending=max_pending)
+    ip_throttle.configure(limit=0)
+    email_throttle.configure(limit=0)
+    
+    return {
+        'method': password_hasher.method,
+        'workers': workers,
+        'max_pending': max_pending,
+        'levels': [run_level(concurrency, logins, emails) for concurrency in levels],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bench.login', description=__doc__.splitlines()[0])
+    parser.add_argument('--levels', default='1,4,16,64', help='comma separated concurrency levels')
+    parser.add_argument('--logins', type=int, default=64, help='logins per level')
+    parser.add_argument('--workers', type=int, default=app.config['PASSWORD_HASH_WORKERS'])
+    parser.add_argument('--max-pending', type=int, default=app.config['PASSWORD_HASH_MAX_PENDING'])
+    parser.add_argument('--method', default='scrypt', help='hash method the seeded users were hashed with')
+    args = parser.parse_args(argv)
+    
+    levels = [int(level) for level in args.levels.split(',')]
+    result = run(levels, args.logins, args.workers, args.max_pending, args.method)
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,73 @@
+"""Startup cost benchmark.
+
+Starts a fresh interpreter that imports the app under ``python -X
+importtime`` and then runs app.startup.warm_up(). Reports the import time
+broken down by top-level package and by app module, and the wall time of
+each warmup step, so cold-start regressions show up in review.
+
+    python -m bench.startup --top 15
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+CHILD = 'import json, run; from app.startup import warm_up; print(json.dumps(warm_up()))'
+
+
+def parse_importtime(lines):
+    """Yield (module, self_us, cumulative_us) from -X importtime output"""
+    for line in lines:
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        yield module.strip(), int(self_us), int(cumulative_us)
+
+
+def run(backend, top):
+    env = dict(os.environ, STORAGE_BACKEND=backend, DATASTORE_LOG='0', MAIL_TRANSPORT='memory')
+    started = time.perf_counter()
+    child = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD],
+                           env=env, capture_output=True, text=True, check=True)
+    process_ms = (time.perf_counter() - started) * 1000
+    report = json.loads(child.stdout.strip().splitlines()[-1])
+    
+    by_package = {}
+    app_modules = []
+    for module, self_us, cumulative_us in parse_importtime(child.stderr.splitlines()):
+        package = module.split('.')[0]
+        by_package[package] = by_package.get(package, 0) + self_us
+        if package in ('app', 'run'):
+            app_modules.append({'module': module, 'self_ms': self_us / 1000, 'cumulative_ms': cumulative_us / 1000})
+    
+    packages = sorted(by_package.items(), key=lambda item: item[1], reverse=True)
+    return {
+        'backend': backend,
+        'process_ms': round(process_ms, 1),
+        'import_ms': round(sum(by_package.values()) / 1000, 1),
+        'app_import_ms': report['import_ms'],
+        'by_package': [{'package': name, 'self_ms': round(us / 1000, 1)} for name, us in packages[:top]],
+        'app_modules': sorted(app_modules, key=lambda entry: entry['cumulative_ms'], reverse=True),
+        'warmup': report['steps'],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bench.startup', description=__doc__.splitlines()[0])
+    parser.add_argument('--backend', choices=('memory', 'sqlite', 'firestore'), default='memory')
+    parser.add_argument('--top', type=int, default=15, help='packages to list')
+    parser.add_argument('--output', help='also write the report to this JSON file')
+    args = parser.parse_args(argv)
+    
+    result = run(args.backend, args.top)
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,27 @@
+"""gunicorn settings for the container (see Dockerfile).
+
+The app is imported once in the master and forked into workers
+(preload_app), so imports are paid once per instance rather than once per
+worker. Nothing opens a connection at import, so every worker creates its
+own datastore client, and with it one gRPC channel shared by all of its
+threads. Each worker runs app.startup.warm_up() before it takes requests,
+unless WARMUP_ON_START is 0.
+"""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+# Threaded workers, so open live-update streams do not take a whole worker
+# each, and concurrent requests in a worker share its client
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+timeout = 300
+preload_app = True
+
+
+def post_worker_init(worker):
+    if os.environ.get('WARMUP_ON_START', '1') != '1':
+        return
+    from app.startup import warm_up
+    report = warm_up()
+    worker.log.info('worker %s warmed up: %s', worker.pid, report)